@@ -103,12 +103,33 @@ class AgentManager:
             # Process each group in parallel
             all_tasks = []
             for agent_type, files in agent_groups.items():
+                agent = self.agents.get(agent_type)
+                if len(files) > 1 and hasattr(agent, 'process_batch'):
+                    # Agent shares model calls across files; results are unpacked below
+                    all_tasks.append(agent.process_batch(files, user_id))
+                    continue
                 for file_path in files:
                     task = self.process_file(file_path, user_id, agent_type)
                     all_tasks.append(task)
             
             # Wait for all processing to complete
-            results = await asyncio.gather(*all_tasks, return_exceptions=True)
+            task_results = await asyncio.gather(*all_tasks, return_exceptions=True)
+            
+            # Flatten batched agent results back to one entry per file
+            results = []
+            task_index = 0
+            for agent_type, files in agent_groups.items():
+                agent = self.agents.get(agent_type)
+                if len(files) > 1 and hasattr(agent, 'process_batch'):
+                    batch_result = task_results[task_index]
+                    task_index += 1
+                    if isinstance(batch_result, Exception):
+                        results.extend([batch_result] * len(files))
+                    else:
+                        results.extend(batch_result)
+                else:
+                    results.extend(task_results[task_index:task_index + len(files)])
+                    task_index += len(files)
             
             # Group results by agent type
             agent_results = {}
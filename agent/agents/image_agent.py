@@ -4,8 +4,11 @@ Handles: JPG, JPEG, PNG, GIF, WebP, BMP, TIFF, SVG files
 Features: OCR, chart/diagram interpretation, handwriting recognition, educational content analysis
 """
 import os
+import re
 import json
-from typing import Dict, Any, List, Optional, Tuple
+import math
+import asyncio
+from typing import Dict, Any, List, Literal, Optional, Sequence, Tuple
 from pathlib import Path
 from PIL import Image, ImageEnhance, ImageFilter
 import boto3
@@ -17,18 +20,108 @@ from dataclasses import dataclass
 
 try:
     from ..config.model_manager import model_config_manager
+    from ..services.bedrock_limits import BEDROCK_CALL_SLOTS
 except ImportError:
     # Fallback for when not running as package
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
     from config.model_manager import model_config_manager
+    from services.bedrock_limits import BEDROCK_CALL_SLOTS
 
 
 logger = logging.getLogger(__name__)
 
+# Outermost JSON array/object embedded in a prose-wrapped model response
+JSON_SPAN_PATTERN = re.compile(r'(\[.*\]|\{.*\})', re.S)
 
-@dataclass
+# Default aggregation for image confidence scores; logmean penalizes single weak components
+CONFIDENCE_AGGREGATION = 'logmean'
+CONFIDENCE_TEMPERATURE = 1.5
+CONFIDENCE_EPSILON = 1e-6
+
+# Diagrams add evidence to a base educational value, so this stays noisy-OR (adding a score can
+# only raise the result); the configurable averages would make every diagram a penalty
+EDUCATIONAL_VALUE_AGGREGATION = 'noisy_or'
+
+AggregationMethod = Literal['mean', 'geomean', 'harmonic', 'min', 'logmean', 'noisy_or']
+
+
+def aggregate_confidence(values: Sequence[float],
+                         method: AggregationMethod = CONFIDENCE_AGGREGATION,
+                         temperature: float = 1.0) -> float:
+    """Aggregate probability-like scores in [0, 1] into a single score.
+
+    ``geomean``/``logmean`` compute exp(mean(log(x))) and ``noisy_or`` computes
+    1 - prod(1 - x) in log space. A temperature above 1 calibrates the result
+    upwards via p ** (1 / T).
+    """
+    if not values:
+        return 0.0
+    
+    if method == 'noisy_or':
+        scores = [min(max(float(v), 0.0), 1.0 - CONFIDENCE_EPSILON) for v in values]
+        aggregated = 1.0 - math.exp(math.fsum(math.log1p(-v) for v in scores))
+    else:
+        scores = [min(max(float(v), CONFIDENCE_EPSILON), 1.0) for v in values]
+        if method == 'mean':
+            aggregated = math.fsum(scores) / len(scores)
+        elif method in ('geomean', 'logmean'):
+            aggregated = math.exp(math.fsum(math.log(v) for v in scores) / len(scores))
+        elif method == 'harmonic':
+            aggregated = len(scores) / math.fsum(1.0 / v for v in scores)
+        elif method == 'min':
+            aggregated = min(scores)
+        else:
+            raise ValueError(f"Unknown confidence aggregation method: {method}")
+    
+    if temperature != 1.0:
+        aggregated = aggregated ** (1.0 / temperature)
+    return float(aggregated)
+
+
+# Vision models tried in order for educational content extraction
+EDUCATIONAL_CONTENT_MODEL_IDS = (
+    'anthropic.claude-3-5-sonnet-20240620-v1:0',
+    'anthropic.claude-3-sonnet-20240229-v1:0',
+    'anthropic.claude-3-haiku-20240307-v1:0'
+)
+
+# Output token cap shared by the vision models above, and the share of it each image in a
+# batched request needs for its JSON; the batch size follows so replies are not cut off
+EDUCATIONAL_CONTENT_MAX_TOKENS = 4096
+EDUCATIONAL_CONTENT_TOKENS_PER_IMAGE = 2048
+EDUCATIONAL_CONTENT_BATCH_SIZE = EDUCATIONAL_CONTENT_MAX_TOKENS // EDUCATIONAL_CONTENT_TOKENS_PER_IMAGE
+
+# Media types sent to Bedrock by file extension; anything else keeps the previous PNG label
+IMAGE_MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+
+EDUCATIONAL_CONTENT_BATCH_PROMPT = """You are given {count} images, each preceded by an "Image N" label. They are educational material (cheatsheets, diagrams, notes, slides, etc.).
+
+For EACH image, extract all visible text, key concepts, commands/functions, examples and learning objectives.
+
+Return a JSON array with exactly {count} objects, in the same order as the images, each with this structure:
+{{
+    "full_text_content": "Complete text extracted from the image, preserving structure and formatting",
+    "key_concepts": ["concept1", "concept2", ...],
+    "commands": [{{"name": "command_name", "description": "what it does", "syntax": "usage syntax"}}],
+    "topics": [{{"topic": "topic_name", "description": "detailed explanation"}}],
+    "examples": ["example1", "example2", ...],
+    "learning_objectives": ["objective1", "objective2", ...],
+    "subject_area": "programming|math|science|business|etc",
+    "difficulty_level": "beginner|intermediate|advanced"
+}}
+
+Make sure to extract EVERYTHING visible in each image. Be comprehensive and detailed."""
+
+
+@dataclass(slots=True)
 class EducationalDiagram:
     """Detected educational diagram or flowchart."""
     diagram_type: str  # flowchart, mind_map, organizational_chart, concept_map, etc.
@@ -39,7 +132,7 @@ class EducationalDiagram:
     educational_level: str  # elementary, middle_school, high_school, college
 
 
-@dataclass
+@dataclass(slots=True)
 class VisualCategory:
     """Visual element category with confidence."""
     category: str      # graph, illustration, screenshot, photo, etc.
@@ -57,7 +150,7 @@ class OCRResult:
     detected_languages: List[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class VisualElement:
     """Detected visual element in image."""
     element_type: str  # chart, diagram, table, handwriting, etc.
@@ -67,7 +160,7 @@ class VisualElement:
     extracted_data: Optional[Dict[str, Any]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageAnalysisResult:
     """Comprehensive image analysis result."""
     content_type: str
@@ -82,14 +175,27 @@ class ImageAnalysisResult:
 class ImageAgent:
     """Enhanced image agent with advanced vision capabilities."""
     
-    def __init__(self, region: str = "us-east-1"):
+    def __init__(self, region: str = "us-east-1",
+                 confidence_aggregation: AggregationMethod = CONFIDENCE_AGGREGATION):
         self.region = region
+        self.confidence_aggregation = confidence_aggregation
         self.agent = Agent()
         self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
         self.textract_client = boto3.client('textract', region_name=region)
         self.supported_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff', '.svg']
         self.model_config = model_config_manager.get_model_for_agent("image", "image")
     
+    def _invoke_bedrock(self, model_id: str, payload: Dict[str, Any]) -> str:
+        """Blocking Bedrock call returning the response text; run it via asyncio.to_thread.
+        
+        Calls share the process-wide BEDROCK_CALL_SLOTS with the other agents.
+        """
+        body = json.dumps({"anthropic_version": "bedrock-2023-05-31", **payload})
+        with BEDROCK_CALL_SLOTS:
+            response = self.bedrock_client.invoke_model(modelId=model_id, body=body)
+        result = json.loads(response['body'].read())
+        return result['content'][0]['text']
+    
     def can_process(self, file_path: str) -> bool:
         """Check if this agent can process the given file."""
         return any(file_path.lower().endswith(ext) for ext in self.supported_extensions)
@@ -137,99 +243,142 @@ class ImageAgent:
             # This prevents throttling by consolidating multiple API calls into one
             educational_content = await self._extract_educational_content(resolved_path)
 
-            # Use OCR only if Bedrock extraction failed or returned insufficient content
-            ocr_result = None
-            if not educational_content or not educational_content.get('full_text_content'):
-                logger.warning("Educational content extraction incomplete, falling back to OCR...")
-                ocr_result = await self._extract_text_with_ocr(resolved_path)
-
-            # Skip redundant visual analysis calls to avoid throttling
-            # All content is already extracted in educational_content
-            visual_analysis = None
-            educational_analysis = None
-
-            # Create educational_analysis from educational_content
-            if educational_content:
-                educational_analysis = ImageAnalysisResult(
-                    content_type=educational_content.get('subject_area', 'general_image'),
-                    educational_value=0.9 if educational_content.get('full_text_content') else 0.3,
-                    visual_elements=[],
-                    ocr_result=ocr_result,
-                    key_concepts=educational_content.get('key_concepts', []),
-                    difficulty_level=educational_content.get('difficulty_level', 'intermediate'),
-                    confidence_score=0.85 if educational_content.get('full_text_content') else 0.5
-                )
+            return await self._build_result(file_path, resolved_path, image_data, educational_content)
             
-            # Prepare comprehensive result
-            result = {
-                "agent_type": "image",
-                "file_path": file_path,
-                "status": "completed",
-                "content": {
-                    # Basic image properties
-                    "dimensions": image_data['metadata']['dimensions'],
-                    "format": image_data['metadata']['format'],
-                    "mode": image_data['metadata']['mode'],
-                    "has_transparency": image_data['metadata']['has_transparency'],
-                    "dominant_colors": image_data.get('dominant_colors', []),
-                    "thumbnail_base64": image_data.get('thumbnail_base64', ''),
+        except Exception as e:
+            logger.error(f"Enhanced IMAGE Agent error processing {file_path}: {e}")
+            return await self._recover_from_error(file_path, e)
+    
+    async def process_batch(self, file_paths: List[str], user_id: str,
+                            batch_size: int = EDUCATIONAL_CONTENT_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Process several images, sharing one Bedrock vision call per batch.
+        
+        Batches run concurrently; BEDROCK_CALL_SLOTS bounds the in-flight Bedrock calls.
+        """
+        batches = [file_paths[start:start + batch_size] for start in range(0, len(file_paths), batch_size)]
+        batch_results = await asyncio.gather(*(self._process_image_batch(batch) for batch in batches))
+        return [result for results in batch_results for result in results]
+    
+    async def _process_image_batch(self, batch_paths: List[str]) -> List[Dict[str, Any]]:
+        """Process one batch of images with a single educational-content Bedrock call."""
+        logger.info(f"Enhanced IMAGE Agent batch processing {len(batch_paths)} images")
+        
+        resolved_paths = [self._resolve_file_path(path) for path in batch_paths]
+        image_data_list, educational_contents = await asyncio.gather(
+            asyncio.gather(*(self._extract_image_content(path) for path in resolved_paths)),
+            self._extract_educational_content_batch(resolved_paths)
+        )
+        
+        results = []
+        for file_path, resolved_path, image_data, educational_content in zip(
+            batch_paths, resolved_paths, image_data_list, educational_contents
+        ):
+            try:
+                results.append(await self._build_result(
+                    file_path, resolved_path, image_data, educational_content
+                ))
+            except Exception as e:
+                logger.error(f"Enhanced IMAGE Agent error processing {file_path}: {e}")
+                results.append(await self._recover_from_error(file_path, e))
+        
+        return results
+    
+    async def _build_result(self, file_path: str, resolved_path: str,
+                            image_data: Dict[str, Any],
+                            educational_content: Dict[str, Any]) -> Dict[str, Any]:
+        """Assemble the agent result from extracted image data and educational content."""
+        # Use OCR only if Bedrock extraction failed or returned insufficient content
+        ocr_result = None
+        if not educational_content or not educational_content.get('full_text_content'):
+            logger.warning("Educational content extraction incomplete, falling back to OCR...")
+            ocr_result = await self._extract_text_with_ocr(resolved_path)
 
-                    # **NEW**: Structured educational content for training
-                    "educational_content": educational_content if educational_content else {},
+        # Skip redundant visual analysis calls to avoid throttling
+        # All content is already extracted in educational_content
+        visual_analysis = None
+        educational_analysis = None
 
-                    # Enhanced content extraction
-                    "extracted_text": ocr_result.text if ocr_result else "",
-                    "text_confidence": ocr_result.confidence if ocr_result else 0.0,
-                    "detected_languages": ocr_result.detected_languages if ocr_result else [],
-                    "visual_elements": [
-                        {
-                            "type": elem.element_type,
-                            "confidence": elem.confidence,
-                            "description": elem.description,
-                            "bounding_box": elem.bounding_box,
-                            "extracted_data": elem.extracted_data
-                        }
-                        for elem in visual_analysis.visual_elements
-                    ] if visual_analysis else [],
-                    
-                    # Educational analysis
-                    "educational_value": educational_analysis.educational_value if educational_analysis else 0.0,
-                    "key_concepts": educational_analysis.key_concepts if educational_analysis else [],
-                    "difficulty_level": educational_analysis.difficulty_level if educational_analysis else "unknown",
-                    "content_type": educational_analysis.content_type if educational_analysis else "general_image"
-                },
-                "analysis": {
-                    "ai_analysis": visual_analysis.content_type if visual_analysis else "Basic image processing",
-                    "confidence_score": educational_analysis.confidence_score if educational_analysis else 0.5,
-                    "processing_method": "enhanced_vision_analysis_with_ocr",
-                    "model_used": self.model_config.model_id if self.model_config else "default"
-                },
-                "metadata": {
-                    **image_data['metadata'],
-                    "processed_by": "enhanced_image_agent",
-                    "has_text": bool(ocr_result and ocr_result.text.strip()),
-                    "has_educational_content": bool(educational_analysis and educational_analysis.educational_value > 0.3)
-                }
+        # Create educational_analysis from educational_content
+        if educational_content:
+            educational_analysis = ImageAnalysisResult(
+                content_type=educational_content.get('subject_area', 'general_image'),
+                educational_value=0.9 if educational_content.get('full_text_content') else 0.3,
+                visual_elements=[],
+                ocr_result=ocr_result,
+                key_concepts=educational_content.get('key_concepts', []),
+                difficulty_level=educational_content.get('difficulty_level', 'intermediate'),
+                confidence_score=0.85 if educational_content.get('full_text_content') else 0.5
+            )
+        
+        # Prepare comprehensive result
+        result = {
+            "agent_type": "image",
+            "file_path": file_path,
+            "status": "completed",
+            "content": {
+                # Basic image properties
+                "dimensions": image_data['metadata']['dimensions'],
+                "format": image_data['metadata']['format'],
+                "mode": image_data['metadata']['mode'],
+                "has_transparency": image_data['metadata']['has_transparency'],
+                "dominant_colors": image_data.get('dominant_colors', []),
+                "thumbnail_base64": image_data.get('thumbnail_base64', ''),
+
+                # **NEW**: Structured educational content for training
+                "educational_content": educational_content if educational_content else {},
+
+                # Enhanced content extraction
+                "extracted_text": ocr_result.text if ocr_result else "",
+                "text_confidence": ocr_result.confidence if ocr_result else 0.0,
+                "detected_languages": ocr_result.detected_languages if ocr_result else [],
+                "visual_elements": [
+                    {
+                        "type": elem.element_type,
+                        "confidence": elem.confidence,
+                        "description": elem.description,
+                        "bounding_box": elem.bounding_box,
+                        "extracted_data": elem.extracted_data
+                    }
+                    for elem in visual_analysis.visual_elements
+                ] if visual_analysis else [],
+                
+                # Educational analysis
+                "educational_value": educational_analysis.educational_value if educational_analysis else 0.0,
+                "key_concepts": educational_analysis.key_concepts if educational_analysis else [],
+                "difficulty_level": educational_analysis.difficulty_level if educational_analysis else "unknown",
+                "content_type": educational_analysis.content_type if educational_analysis else "general_image"
+            },
+            "analysis": {
+                "ai_analysis": visual_analysis.content_type if visual_analysis else "Basic image processing",
+                "confidence_score": educational_analysis.confidence_score if educational_analysis else 0.5,
+                "processing_method": "enhanced_vision_analysis_with_ocr",
+                "model_used": self.model_config.model_id if self.model_config else "default"
+            },
+            "metadata": {
+                **image_data['metadata'],
+                "processed_by": "enhanced_image_agent",
+                "has_text": bool(ocr_result and ocr_result.text.strip()),
+                "has_educational_content": bool(educational_analysis and educational_analysis.educational_value > 0.3)
             }
+        }
 
-            logger.info(f"Enhanced IMAGE Agent completed: {file_path} "
-                  f"({image_data['metadata']['dimensions']}, "
-                  f"Educational Value: {educational_analysis.educational_value if educational_analysis else 0:.2f})")
-            return result
-            
-        except Exception as e:
-            logger.error(f"Enhanced IMAGE Agent error processing {file_path}: {e}")
-            # Fallback to basic processing
-            try:
-                return await self._fallback_basic_processing(file_path)
-            except Exception as fallback_error:
-                logger.error(f"Fallback processing also failed: {fallback_error}")
-                return {
-                    "agent_type": "image",
-                    "file_path": file_path,
-                    "status": "error",
-                    "error": str(e)
-                }
+        logger.info(f"Enhanced IMAGE Agent completed: {file_path} "
+              f"({image_data['metadata']['dimensions']}, "
+              f"Educational Value: {educational_analysis.educational_value if educational_analysis else 0:.2f})")
+        return result
+    
+    async def _recover_from_error(self, file_path: str, error: Exception) -> Dict[str, Any]:
+        """Fall back to basic processing after an enhanced processing failure."""
+        try:
+            return await self._fallback_basic_processing(file_path)
+        except Exception as fallback_error:
+            logger.error(f"Fallback processing also failed: {fallback_error}")
+            return {
+                "agent_type": "image",
+                "file_path": file_path,
+                "status": "error",
+                "error": str(error)
+            }
     
     async def _extract_educational_content(self, file_path: str) -> Dict[str, Any]:
         """Extract structured educational content from image using Bedrock vision."""
@@ -290,18 +439,12 @@ Return your response as a JSON object with this exact structure:
 Make sure to extract EVERYTHING visible in the image. Be comprehensive and detailed."""
 
             # Try multiple models for better availability
-            model_ids = [
-                'anthropic.claude-3-5-sonnet-20240620-v1:0',
-                'anthropic.claude-3-sonnet-20240229-v1:0',
-                'anthropic.claude-3-haiku-20240307-v1:0'
-            ]
-
-            for model_id in model_ids:
+            for model_id in EDUCATIONAL_CONTENT_MODEL_IDS:
                 try:
-                    response = self.bedrock_client.invoke_model(
-                        modelId=model_id,
-                        body=json.dumps({
-                            "anthropic_version": "bedrock-2023-05-31",
+                    content_text = await asyncio.to_thread(
+                        self._invoke_bedrock,
+                        model_id,
+                        {
                             "max_tokens": 4096,
                             "messages": [
                                 {
@@ -322,12 +465,9 @@ Make sure to extract EVERYTHING visible in the image. Be comprehensive and detai
                                     ]
                                 }
                             ]
-                        })
+                        }
                     )
 
-                    result = json.loads(response['body'].read())
-                    content_text = result['content'][0]['text']
-
                     # Parse JSON response
                     try:
                         # Try to find JSON in the response
@@ -365,8 +505,87 @@ Make sure to extract EVERYTHING visible in the image. Be comprehensive and detai
             logger.error(f"Error extracting educational content: {e}")
             return {}
 
-    async def _extract_image_content(self, file_path: str) -> Dict[str, Any]:
-        """Extract image content and metadata."""
+    async def _extract_educational_content_batch(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """Extract educational content for several images with a single Bedrock vision call."""
+        if len(file_paths) == 1:
+            return [await self._extract_educational_content(file_paths[0])]
+        
+        # SVGs are skipped by the vision model, same as the single-image path
+        batch_indices = [i for i, path in enumerate(file_paths) if not path.lower().endswith('.svg')]
+        contents: List[Dict[str, Any]] = [{} for _ in file_paths]
+        if not batch_indices:
+            return contents
+        
+        try:
+            message_content = [{
+                "type": "text",
+                "text": EDUCATIONAL_CONTENT_BATCH_PROMPT.format(count=len(batch_indices))
+            }]
+            images_base64 = await asyncio.gather(
+                *(asyncio.to_thread(self._read_image_base64, file_paths[index]) for index in batch_indices)
+            )
+            for image_number, (index, image_base64) in enumerate(zip(batch_indices, images_base64), 1):
+                message_content.append({"type": "text", "text": f"Image {image_number}:"})
+                message_content.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": IMAGE_MEDIA_TYPES.get(Path(file_paths[index]).suffix.lower(), 'image/png'),
+                        "data": image_base64
+                    }
+                })
+            max_tokens = min(EDUCATIONAL_CONTENT_TOKENS_PER_IMAGE * len(batch_indices), EDUCATIONAL_CONTENT_MAX_TOKENS)
+            
+            logger.info(f"📸 Extracting educational content from {len(batch_indices)} images in one Bedrock call...")
+            
+            for model_id in EDUCATIONAL_CONTENT_MODEL_IDS:
+                try:
+                    content_text = await asyncio.to_thread(
+                        self._invoke_bedrock,
+                        model_id,
+                        {
+                            "max_tokens": max_tokens,
+                            "messages": [{"role": "user", "content": message_content}]
+                        }
+                    )
+                    batch_data = self._parse_llm_json(content_text.strip())
+                    
+                    if isinstance(batch_data, list) and len(batch_data) == len(batch_indices):
+                        for index, educational_data in zip(batch_indices, batch_data):
+                            contents[index] = educational_data if isinstance(educational_data, dict) else {}
+                        logger.info(f"Successfully extracted batched educational content using {model_id}")
+                        return contents
+                    
+                    logger.warning(f"Model {model_id} returned a malformed batch response")
+                    break
+                    
+                except Exception as model_error:
+                    logger.error(f"Model {model_id} failed: {model_error}")
+                    continue
+        
+        except Exception as e:
+            logger.error(f"Error extracting batched educational content: {e}")
+        
+        # Fall back to one request per image
+        logger.warning("Batched educational content extraction failed, extracting images individually")
+        individual_contents = await asyncio.gather(
+            *(self._extract_educational_content(file_paths[index]) for index in batch_indices)
+        )
+        for index, educational_data in zip(batch_indices, individual_contents):
+            contents[index] = educational_data
+        return contents
+    
+    def _read_image_base64(self, file_path: str) -> str:
+        """Read an image file and return its base64 encoding; blocking, run it via asyncio.to_thread."""
+        with open(file_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('utf-8')
+    
+    async def _extract_image_content(self, file_path: str, compact_thumbnail: bool = False) -> Dict[str, Any]:
+        """Extract image content and metadata.
+        
+        With ``compact_thumbnail`` the thumbnail is encoded as WebP for returning to
+        clients; otherwise it is the JPEG sent to Bedrock for analysis.
+        """
         try:
             # Handle SVG files separately
             if file_path.lower().endswith('.svg'):
@@ -414,9 +633,7 @@ Make sure to extract EVERYTHING visible in the image. Be comprehensive and detai
                     thumbnail = thumbnail.convert('RGB')
                 
                 # Convert to base64
-                buffer = io.BytesIO()
-                thumbnail.save(buffer, format='JPEG', quality=85)
-                thumbnail_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                thumbnail_base64, thumbnail_media_type = self._encode_thumbnail(thumbnail, compact_thumbnail)
                 
                 # Extract dominant colors (simplified)
                 dominant_colors = await self._extract_dominant_colors(img)
@@ -424,6 +641,7 @@ Make sure to extract EVERYTHING visible in the image. Be comprehensive and detai
                 return {
                     "metadata": metadata,
                     "thumbnail_base64": thumbnail_base64,
+                    "thumbnail_media_type": thumbnail_media_type,
                     "dominant_colors": dominant_colors
                 }
                 
@@ -441,6 +659,20 @@ Make sure to extract EVERYTHING visible in the image. Be comprehensive and detai
                 "dominant_colors": []
             }
     
+    def _encode_thumbnail(self, thumbnail: Image.Image, compact: bool) -> Tuple[str, str]:
+        """Encode an in-memory thumbnail as base64, WebP when compact and JPEG otherwise."""
+        if compact:
+            try:
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, format='WEBP', quality=75, method=4)
+                return base64.b64encode(buffer.getvalue()).decode('utf-8'), "image/webp"
+            except Exception as e:
+                logger.warning(f"Could not encode thumbnail as WebP, using JPEG: {e}")
+        
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=85)
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), "image/jpeg"
+    
     async def _process_svg(self, file_path: str) -> Dict[str, Any]:
         """Process SVG files."""
         try:
@@ -869,10 +1101,11 @@ Return your analysis as a JSON object with this structure:
         educational_analysis = analysis_data.get('educational_analysis', {})
         overall_assessment = analysis_data.get('overall_assessment', {})
         
-        # Enhanced educational value calculation
+        # Enhanced educational value: each educational diagram is extra evidence
         base_educational_value = overall_assessment.get('educational_value', 0.0)
-        diagram_boost = len(diagrams) * 0.2  # Boost for educational diagrams
-        educational_value = min(base_educational_value + diagram_boost, 1.0)
+        educational_value = aggregate_confidence(
+            [base_educational_value] + [0.2] * len(diagrams), method=EDUCATIONAL_VALUE_AGGREGATION
+        )
         
         return ImageAnalysisResult(
             content_type=overall_assessment.get('content_type', 'general_image'),
@@ -889,11 +1122,12 @@ Return your analysis as a JSON object with this structure:
                            categories: List[VisualCategory]) -> ImageAnalysisResult:
         """Parse unstructured text analysis as fallback with enhanced data."""
         visual_elements = []
+        text_lower = analysis_text.lower()
         
         # Look for common visual element indicators
-        element_types = ['chart', 'diagram', 'table', 'equation', 'graph', 'flowchart']
+        element_types = ('chart', 'diagram', 'table', 'equation', 'graph', 'flowchart')
         for elem_type in element_types:
-            if elem_type.lower() in analysis_text.lower():
+            if elem_type in text_lower:
                 element = VisualElement(
                     element_type=elem_type,
                     confidence=0.6,
@@ -933,13 +1167,15 @@ Return your analysis as a JSON object with this structure:
         educational_indicators = ['educational', 'learning', 'academic', 'study', 'course', 'lesson']
         educational_value = 0.3  # Default
         for indicator in educational_indicators:
-            if indicator in analysis_text.lower():
+            if indicator in text_lower:
                 educational_value = 0.7
                 break
         
         # Boost educational value for detected diagrams
         if diagrams:
-            educational_value = min(educational_value + len(diagrams) * 0.15, 1.0)
+            educational_value = aggregate_confidence(
+                [educational_value] + [0.15] * len(diagrams), method=EDUCATIONAL_VALUE_AGGREGATION
+            )
         
         return ImageAnalysisResult(
             content_type='general_image',
@@ -1069,7 +1305,8 @@ Please provide enhanced analysis in JSON format:
                     visual_analysis.educational_value,
                     enhancement_data.get('educational_value', 0.0)
                 )
-                visual_analysis.confidence_score = min(visual_analysis.confidence_score + 0.2, 1.0)
+                boosted_confidence = visual_analysis.confidence_score + 0.2
+                visual_analysis.confidence_score = boosted_confidence if boosted_confidence < 1.0 else 1.0
                 
                 return visual_analysis
                 
@@ -1084,7 +1321,7 @@ Please provide enhanced analysis in JSON format:
     async def _fallback_basic_processing(self, file_path: str) -> Dict[str, Any]:
         """Fallback to basic image processing when enhanced processing fails."""
         try:
-            image_data = await self._extract_image_content(file_path)
+            image_data = await self._extract_image_content(file_path, compact_thumbnail=True)
             
             return {
                 "agent_type": "image",
@@ -1097,6 +1334,7 @@ Please provide enhanced analysis in JSON format:
                     "has_transparency": image_data['metadata']['has_transparency'],
                     "dominant_colors": image_data.get('dominant_colors', []),
                     "thumbnail_base64": image_data.get('thumbnail_base64', ''),
+                    "thumbnail_media_type": image_data.get('thumbnail_media_type', 'image/jpeg'),
                     "extracted_text": "",
                     "text_confidence": 0.0,
                     "visual_elements": [],
@@ -1246,34 +1484,44 @@ If no educational diagrams are detected, return an empty array [].
             result = json.loads(response['body'].read())
             analysis_text = result['content'][0]['text'].strip()
             
-            try:
-                # Try to parse as JSON
-                diagrams_data = json.loads(analysis_text)
-                if not isinstance(diagrams_data, list):
-                    return []
-                
-                diagrams = []
-                for diagram_data in diagrams_data:
-                    diagram = EducationalDiagram(
-                        diagram_type=diagram_data.get('diagram_type', 'unknown'),
-                        complexity=diagram_data.get('complexity', 'moderate'),
-                        subject_area=diagram_data.get('subject_area', 'general'),
-                        elements=diagram_data.get('elements', []),
-                        confidence=diagram_data.get('confidence', 0.5),
-                        educational_level=diagram_data.get('educational_level', 'unknown')
-                    )
-                    diagrams.append(diagram)
-                
-                return diagrams
-                
-            except json.JSONDecodeError:
+            diagrams_data = self._parse_llm_json(analysis_text)
+            if diagrams_data is None:
                 # Fallback: parse text response for diagram indicators
                 return self._parse_diagram_text(analysis_text)
+            if not isinstance(diagrams_data, list):
+                return []
+            
+            diagrams = []
+            for diagram_data in diagrams_data:
+                diagram = EducationalDiagram(
+                    diagram_type=diagram_data.get('diagram_type', 'unknown'),
+                    complexity=diagram_data.get('complexity', 'moderate'),
+                    subject_area=diagram_data.get('subject_area', 'general'),
+                    elements=diagram_data.get('elements', []),
+                    confidence=diagram_data.get('confidence', 0.5),
+                    educational_level=diagram_data.get('educational_level', 'unknown')
+                )
+                diagrams.append(diagram)
+            
+            return diagrams
             
         except Exception as e:
             logger.error(f"Error detecting educational diagrams: {e}")
             return []
     
+    def _parse_llm_json(self, analysis_text: str) -> Optional[Any]:
+        """Parse JSON from a model response, returning None when no JSON is present."""
+        if analysis_text[:1] not in ('[', '{'):
+            # Model wrapped the JSON in prose; only parse the embedded span
+            json_match = JSON_SPAN_PATTERN.search(analysis_text)
+            if not json_match:
+                return None
+            analysis_text = json_match.group(0)
+        try:
+            return json.loads(analysis_text)
+        except json.JSONDecodeError:
+            return None
+    
     def _parse_diagram_text(self, analysis_text: str) -> List[EducationalDiagram]:
         """Parse text response for diagram indicators as fallback."""
         diagrams = []
@@ -1398,26 +1646,24 @@ Return as JSON array:
             result = json.loads(response['body'].read())
             analysis_text = result['content'][0]['text'].strip()
             
-            try:
-                categories_data = json.loads(analysis_text)
-                if not isinstance(categories_data, list):
-                    return []
-                
-                categories = []
-                for cat_data in categories_data:
-                    category = VisualCategory(
-                        category=cat_data.get('category', 'unknown'),
-                        subcategory=cat_data.get('subcategory', ''),
-                        confidence=cat_data.get('confidence', 0.5),
-                        features=cat_data.get('features', {})
-                    )
-                    categories.append(category)
-                
-                return categories
-                
-            except json.JSONDecodeError:
+            categories_data = self._parse_llm_json(analysis_text)
+            if categories_data is None:
                 # Fallback categorization
                 return self._fallback_categorization(analysis_text)
+            if not isinstance(categories_data, list):
+                return []
+            
+            categories = []
+            for cat_data in categories_data:
+                category = VisualCategory(
+                    category=cat_data.get('category', 'unknown'),
+                    subcategory=cat_data.get('subcategory', ''),
+                    confidence=cat_data.get('confidence', 0.5),
+                    features=cat_data.get('features', {})
+                )
+                categories.append(category)
+            
+            return categories
             
         except Exception as e:
             logger.error(f"Error categorizing visual elements: {e}")
@@ -1471,30 +1717,27 @@ Return as JSON array:
                                         categories: List[VisualCategory]) -> float:
         """Calculate overall confidence score for visual content interpretation."""
         try:
+            # Pool every component score and aggregate once (not a mean of means)
             confidence_factors = []
             
             # OCR confidence
             if ocr_result and ocr_result.text.strip():
-                confidence_factors.append(ocr_result.confidence * 0.3)
+                confidence_factors.append(ocr_result.confidence)
             
             # Visual analysis confidence
             if visual_analysis:
-                confidence_factors.append(visual_analysis.confidence_score * 0.4)
+                confidence_factors.append(visual_analysis.confidence_score)
             
-            # Diagram detection confidence
-            if diagrams:
-                avg_diagram_confidence = sum(d.confidence for d in diagrams) / len(diagrams)
-                confidence_factors.append(avg_diagram_confidence * 0.2)
+            # Diagram detection and category confidences
+            confidence_factors.extend(d.confidence for d in diagrams)
+            confidence_factors.extend(c.confidence for c in categories)
             
-            # Category confidence
-            if categories:
-                avg_category_confidence = sum(c.confidence for c in categories) / len(categories)
-                confidence_factors.append(avg_category_confidence * 0.1)
-            
-            # Calculate weighted average
             if confidence_factors:
-                overall_confidence = sum(confidence_factors) / len(confidence_factors)
-                return min(overall_confidence, 1.0)
+                return aggregate_confidence(
+                    confidence_factors,
+                    method=self.confidence_aggregation,
+                    temperature=CONFIDENCE_TEMPERATURE
+                )
             
             return 0.5  # Default confidence
             
@@ -4,30 +4,138 @@ Handles: PDF files with text extraction, metadata, structure analysis,
          image extraction, table detection, and annotation processing
 """
 import os
+import re
 import json
 import io
-import base64
+import sys
+import asyncio
+import hashlib
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from functools import lru_cache
 from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
-import PyPDF2
-import boto3
 from strands import Agent
-import fitz  # PyMuPDF for advanced PDF processing
-import pandas as pd
-from PIL import Image
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Shared pool for writing extracted images to disk while page extraction continues.
+# Image writers only touch bytes; PyMuPDF itself is only used from the extracting thread.
+IMAGE_IO_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf-image-io")
+
+# Extracted PDF images are written here, one subdirectory per document
+PDF_IMAGES_ROOT = Path(__file__).resolve().parent.parent.parent / "backend" / "data" / "pdf_images"
+
+# All cross-reference kinds in one alternation; the named group that matched gives the kind
+CROSS_REFERENCE_PATTERN = re.compile(
+    r'(?:(?P<figures>Figure|Fig\.?)|(?P<tables>Table|Tbl\.?)|(?P<sections>Section|Sec\.?)|(?P<pages>page|p\.?))'
+    r'\s+(?P<number>\d+(?:\.\d+)?)',
+    re.IGNORECASE
+)
+
+# Characters kept from either side of a page break when looking for references split across it
+# (e.g. "see Figure" / "3.2"); far longer than any keyword plus its whitespace and number
+CROSS_REFERENCE_SEAM_CHARS = 256
+
+# Cached extraction results, keyed by PDF content digest. Bump the version whenever
+# the extraction output changes; entries from other versions are deleted on the next write.
+PDF_EXTRACTION_CACHE_DIR = PDF_IMAGES_ROOT.parent / "pdf_extraction_cache"
+PDF_EXTRACTION_VERSION = "5"
+
+# Total size the extraction cache may reach before the least recently used entries are deleted
+PDF_EXTRACTION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Pages with less text than this and no images/annotations skip table detection
+MIN_CONTENT_PAGE_CHARS = 16
+
+# Characters of document text included in the analysis prompt
+PROMPT_PREVIEW_CHARS = 3000
+
+# Smart previews remembered per (content digest, max length), oldest evicted first
+PREVIEW_CACHE_SIZE = 128
+
+# Paragraph classifications remembered per content digest. They hold the paragraphs
+# themselves, and are only reused between the previews of the document being analysed,
+# so just the latest one is kept
+PARTITION_CACHE_SIZE = 1
+
+# Words marking a paragraph as important for the smart preview, matched anywhere in one pass
+PREVIEW_KEYWORDS = (
+    'abstract', 'introduction', 'conclusion', 'summary', 'important', 'key',
+    'definition', 'overview', 'objective', 'goal', 'purpose', 'main', 'primary',
+    'essential', 'figure', 'table', 'chapter', 'section'
+)
+PREVIEW_KEYWORD_PATTERN = re.compile('|'.join(PREVIEW_KEYWORDS), re.IGNORECASE)
+
+# Fields of an extracted image returned to callers (never the inline bytes)
+IMAGE_REFERENCE_FIELDS = ('page', 'index', 'bbox', 'width', 'height', 'format', 'path', 'size_bytes')
+
+# Reference kinds the cross-page resolvers can tie to document content, in one alternation
+RESOLVABLE_REFERENCE_PATTERN = re.compile(
+    r'(?:(?P<figures>Figure|Fig\.?)|(?P<tables>Table|Tbl\.?)|(?P<sections>Section|Sec\.?|Chapter|Ch\.?))'
+    r'\s+(?P<number>\d+(?:\.\d+)?)',
+    re.IGNORECASE
+)
+SECTION_HEADING_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)*)\s+(\S.*?)\s*$')
+KEY_TERM_PATTERN = re.compile(r'\b[A-Za-z]{4,}\b')
+
+KEY_TERM_STOP_WORDS = frozenset({'this', 'that', 'with', 'have', 'will', 'from', 'they', 'been', 'were', 'said'})
+CONTINUATION_WORDS = ('however', 'therefore', 'furthermore', 'moreover', 'additionally')
+
+# Phrases marking content that carries over a page break, matched in one pass
+TRANSITION_PHRASES = (
+    'continued on next page', 'see next page', 'table continues',
+    'figure continues', 'to be continued'
+)
+TRANSITION_PHRASE_PATTERN = re.compile('|'.join(map(re.escape, TRANSITION_PHRASES)))
+
+# Documents at least this long scan pages for references on a worker thread so the
+# event loop stays responsive; shorter scans are cheaper than the thread hand-off
+THREADED_REFERENCE_SCAN_MIN_PAGES = 64
+
+# Maximum width difference (px) for images on adjacent pages to count as one continued figure
+FIGURE_WIDTH_TOLERANCE = 50
+
+# Embedded image formats that can be passed through without re-encoding
+EXTRACTABLE_IMAGE_FORMATS = frozenset({'png', 'jpeg', 'jpg', 'gif', 'bmp', 'tiff', 'webp'})
+
 # Import error handler
 try:
     from ..services.processing_error_handler import processing_error_handler
+    from ..services.bedrock_limits import BEDROCK_CONCURRENCY, BEDROCK_CALL_SLOTS
 except ImportError:
     # Fallback for when not running as package
-    import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
     from services.processing_error_handler import processing_error_handler
+    from services.bedrock_limits import BEDROCK_CONCURRENCY, BEDROCK_CALL_SLOTS
+
+
+def scan_page_references(page_text: str) -> Dict[str, List[Tuple[str, int, str]]]:
+    """Find figure, table and section references on one page as (number, position, match) tuples."""
+    references = {"figures": [], "tables": [], "sections": []}
+    for match in RESOLVABLE_REFERENCE_PATTERN.finditer(page_text):
+        kind = next(k for k in references if match.group(k))
+        references[kind].append((match.group("number"), match.start(), match.group(0)))
+    return references
+
+
+def scan_pages_references(text_pages: List[str]) -> List[Dict[str, List[Tuple[str, int, str]]]]:
+    """Scan each page for references, in page order."""
+    return [scan_page_references(page_text) for page_text in text_pages]
+
+
+@lru_cache(maxsize=4096)
+def extract_key_terms(text_lower: str) -> Tuple[str, ...]:
+    """Most frequent non-stop-word terms of lowercased text, memoized since pages are re-analysed across passes."""
+    # Count every word in C (Counter's list fast path), then drop the few stop words from the tally
+    term_counts = Counter(KEY_TERM_PATTERN.findall(text_lower))
+    for stop_word in KEY_TERM_STOP_WORDS:
+        term_counts.pop(stop_word, None)
+    return tuple(term for term, count in term_counts.most_common(10))
 
 
 class PDFAgent:
@@ -36,8 +144,13 @@ class PDFAgent:
     def __init__(self, region: str = "us-east-1"):
         self.region = region
         self.agent = Agent()
-        self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
+        self._bedrock_client = None
         self.supported_extensions = ['.pdf']
+        # Successful path resolutions only, so files uploaded later are still found
+        self._resolved_paths: Dict[str, str] = {}
+        # Previews are rebuilt for the same document on retries and repeated analyses
+        self._preview_cache: Dict[Tuple[bytes, int], str] = {}
+        self._partition_cache: Dict[bytes, Tuple[List, List]] = {}
         
         # Import model configuration manager
         try:
@@ -45,7 +158,6 @@ class PDFAgent:
             self.model_manager = model_config_manager
         except ImportError:
             # Fallback for when not running as package
-            import sys
             import os
             sys.path.append(os.path.dirname(os.path.dirname(__file__)))
             from config.model_manager import model_config_manager
@@ -54,43 +166,64 @@ class PDFAgent:
             logger.warning("Model configuration manager not available, using default model")
             self.model_manager = None
     
+    @property
+    def bedrock_client(self):
+        """Bedrock runtime client, created on first use to keep boto3 out of agent start-up."""
+        if self._bedrock_client is None:
+            import boto3
+            from botocore.config import Config
+            # Keep one pooled connection per call slot so concurrent analyses reuse TLS sessions,
+            # and let botocore pace retries when Bedrock throttles
+            self._bedrock_client = boto3.client(
+                'bedrock-runtime',
+                region_name=self.region,
+                config=Config(max_pool_connections=BEDROCK_CONCURRENCY, retries={"mode": "adaptive"})
+            )
+        return self._bedrock_client
+    
+    def _invoke_bedrock(self, model_id: str, payload: Dict[str, Any]) -> str:
+        """Blocking Bedrock call returning the response text; run it via asyncio.to_thread.
+        
+        Request serialisation and response parsing happen here too, so large prompt
+        bodies never tie up the event loop. Calls are throttled to BEDROCK_CALL_SLOTS.
+        """
+        body = json.dumps({"anthropic_version": "bedrock-2023-05-31", **payload})
+        with BEDROCK_CALL_SLOTS:
+            response = self.bedrock_client.invoke_model(modelId=model_id, body=body)
+        result = json.loads(response['body'].read())
+        return result['content'][0]['text']
+    
     def can_process(self, file_path: str) -> bool:
         """Check if this agent can process the given file."""
         return file_path.lower().endswith('.pdf')
 
     def _resolve_file_path(self, file_path) -> str:
         """Resolve file path relative to project structure. Accepts string or Path."""
+        cached_path = self._resolved_paths.get(str(file_path))
+        if cached_path is not None:
+            return cached_path
+        
         # Convert to Path if string
         file_path_obj = Path(file_path) if isinstance(file_path, str) else file_path
-
         logger.debug(f"PDF Agent - Resolving file path: {file_path_obj}")
-        logger.debug(f"PDF Agent - Current working directory: {Path.cwd()}")
-
-        # If the path exists as-is, use it
-        if file_path_obj.exists():
-            logger.info(f"PDF Agent - Found file at original path: {file_path_obj}")
-            return str(file_path_obj)
-
-        # Try in backend directory (most common case)
-        backend_path = Path("backend") / file_path_obj
-        logger.debug(f"PDF Agent - Trying backend path: {backend_path}")
-        if backend_path.exists():
-            logger.info(f"PDF Agent - Found file at backend path: {backend_path}")
-            return str(backend_path)
-
-        # Try relative to backend directory (from agent directory)
-        backend_relative_path = Path("../backend") / file_path_obj
-        logger.debug(f"PDF Agent - Trying backend relative path: {backend_relative_path}")
-        if backend_relative_path.exists():
-            logger.info(f"PDF Agent - Found file at backend relative path: {backend_relative_path}")
-            return str(backend_relative_path)
 
-        # Try absolute path from project root
-        project_root_path = Path("..") / file_path_obj
-        logger.debug(f"PDF Agent - Trying project root path: {project_root_path}")
-        if project_root_path.exists():
-            logger.info(f"PDF Agent - Found file at project root path: {project_root_path}")
-            return str(project_root_path)
+        # As-is, backend directory (most common case), backend relative to the
+        # agent directory, then relative to the project root
+        candidates = (
+            file_path_obj,
+            Path("backend") / file_path_obj,
+            Path("../backend") / file_path_obj,
+            Path("..") / file_path_obj
+        )
+        for candidate in candidates:
+            try:
+                os.stat(candidate)
+            except (OSError, ValueError):
+                # Missing, unreadable or invalid candidates all mean "not here"
+                continue
+            logger.info(f"PDF Agent - Found file at: {candidate}")
+            self._resolved_paths[str(file_path)] = str(candidate)
+            return str(candidate)
 
         # Return original path if nothing works
         logger.error(f"PDF Agent - Could not resolve file path, using original: {file_path_obj}")
@@ -128,7 +261,7 @@ class PDFAgent:
                     "page_count": pdf_data['metadata']['page_count'],
                     "word_count": len(pdf_data['text'].split()),
                     "char_count": len(pdf_data['text']),
-                    "images": pdf_data.get('images', []),
+                    "images": [self._image_reference(img) for img in pdf_data.get('images', [])],
                     "tables": pdf_data.get('tables', []),
                     "annotations": pdf_data.get('annotations', [])
                 },
@@ -166,18 +299,42 @@ class PDFAgent:
                 **error_response
             }
     
-    async def _extract_comprehensive_content(self, file_path: str) -> Dict[str, Any]:
-        """Extract comprehensive content including text, images, tables, and annotations."""
+    def _image_reference(self, image_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Describe an extracted image by its file path; consumers read the bytes lazily."""
+        return {key: image_info[key] for key in IMAGE_REFERENCE_FIELDS if key in image_info}
+    
+    async def _extract_comprehensive_content(self, resolved_path: str,
+                                             images_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Extract comprehensive content including text, images, tables, and annotations.
+
+        ``resolved_path`` must already have gone through ``_resolve_file_path``.
+        Images are written to ``images_dir`` and referenced by path.
+
+        Results are cached on disk by file content, so re-processing an
+        unchanged PDF skips extraction entirely.
+        """
         try:
-            # Resolve file path first
-            resolved_path = self._resolve_file_path(file_path)
             logger.info(f"PDF Agent processing resolved path: {resolved_path}")
             
+            if images_dir is None:
+                images_dir = self._get_images_dir(resolved_path)
+            images_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Hashing reads the whole file, so keep it off the event loop
+            cache_path = await asyncio.to_thread(self._get_extraction_cache_path, resolved_path)
+            if cache_path is not None:
+                cached_data = self._load_cached_extraction(cache_path, images_dir)
+                if cached_data is not None:
+                    logger.info(f"PDF Agent using cached extraction for {resolved_path}")
+                    return cached_data
+            
             # Use PyMuPDF for advanced extraction
+            import fitz
             doc = fitz.open(resolved_path)
             
             # Initialize extraction results
-            all_text = []
+            text_buf = io.StringIO()
+            all_text = []  # Per-page text, shared with the cross-page resolvers
             all_images = []
             all_tables = []
             all_annotations = []
@@ -191,14 +348,19 @@ class PDFAgent:
             outline = doc.get_toc()
             structured_content["document_outline"] = self._process_outline(outline)
             
-            # Process each page
+            # Process each page; PyMuPDF is not thread-safe, so pages are extracted one after another
             for page_num in range(len(doc)):
-                page = doc[page_num]
-                page_data = await self._extract_page_content(page, page_num + 1)
+                page_data = self._extract_page_content(
+                    doc[page_num], page_num + 1, images_dir
+                )
                 
                 # Collect page text
                 if page_data['text']:
-                    all_text.append(f"--- Page {page_num + 1} ---\n{page_data['text']}")
+                    if text_buf.tell():
+                        text_buf.write("\n\n")
+                    text_buf.write(f"--- Page {page_num + 1} ---\n")
+                    text_buf.write(page_data['text'])
+                    all_text.append(page_data['text'])
                 
                 # Collect images
                 all_images.extend(page_data['images'])
@@ -219,7 +381,7 @@ class PDFAgent:
                 })
             
             # Extract metadata
-            metadata = self._extract_enhanced_metadata(doc, file_path)
+            metadata = self._extract_enhanced_metadata(doc, resolved_path)
             
             # Detect cross-references and correlate content
             structured_content["cross_references"] = self._detect_cross_references(all_text)
@@ -232,8 +394,8 @@ class PDFAgent:
             
             doc.close()
             
-            return {
-                "text": '\n\n'.join(all_text),
+            pdf_data = {
+                "text": text_buf.getvalue(),
                 "images": all_images,
                 "tables": all_tables,
                 "annotations": all_annotations,
@@ -241,14 +403,101 @@ class PDFAgent:
                 "metadata": metadata
             }
             
+            if cache_path is not None:
+                self._store_cached_extraction(cache_path, images_dir, pdf_data)
+            
+            return pdf_data
+            
         except Exception as e:
-            logger.error(f"Error in comprehensive PDF extraction for {file_path}: {e}")
+            logger.error(f"Error in comprehensive PDF extraction for {resolved_path}: {e}")
             # Fallback to basic extraction
-            return await self._extract_pdf_content_fallback(file_path)
+            return await self._extract_pdf_content_fallback(resolved_path)
+    
+    def _get_images_dir(self, resolved_path: str) -> Path:
+        """Return the per-document directory that extracted images are written to."""
+        path_digest = hashlib.md5(str(Path(resolved_path).resolve()).encode()).hexdigest()[:12]
+        return PDF_IMAGES_ROOT / f"{Path(resolved_path).stem}_{path_digest}"
+    
+    def _get_extraction_cache_path(self, resolved_path: str) -> Optional[Path]:
+        """Return the cache file for this PDF's content, or None if it cannot be hashed."""
+        try:
+            digest = hashlib.sha256()
+            with open(resolved_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except OSError as e:
+            logger.warning(f"Could not hash {resolved_path} for extraction cache: {e}")
+            return None
+        return PDF_EXTRACTION_CACHE_DIR / f"{digest.hexdigest()}_v{PDF_EXTRACTION_VERSION}.json"
+    
+    def _load_cached_extraction(self, cache_path: Path, images_dir: Path) -> Optional[Dict[str, Any]]:
+        """Load a cached extraction if it is still valid for ``images_dir``."""
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache_entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache {cache_path}: {e}")
+            return None
+        
+        pdf_data = cache_entry.get("pdf_data")
+        if cache_entry.get("images_dir") != str(images_dir) or not pdf_data:
+            return None
+        # Images live outside the cache file; re-extract if any were cleaned up
+        if not all(Path(img["path"]).exists() for img in pdf_data.get("images", [])):
+            return None
+        # Mark the entry as recently used so pruning keeps it
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return pdf_data
+    
+    def _store_cached_extraction(self, cache_path: Path, images_dir: Path, pdf_data: Dict[str, Any]) -> None:
+        """Persist an extraction result atomically; caching failures never fail processing."""
+        # Writers for the same digest on other threads or processes each get their own temp file
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"images_dir": str(images_dir), "pdf_data": pdf_data}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not write extraction cache {cache_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        
+        self._prune_extraction_cache()
+    
+    def _prune_extraction_cache(self) -> None:
+        """Delete entries from other extraction versions, then the least recently used ones over the size cap."""
+        current_suffix = f"_v{PDF_EXTRACTION_VERSION}.json"
+        entries = []
+        try:
+            for entry in os.scandir(PDF_EXTRACTION_CACHE_DIR):
+                if not entry.is_file():
+                    continue
+                if not entry.name.endswith(current_suffix):
+                    os.unlink(entry.path)
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= PDF_EXTRACTION_CACHE_MAX_BYTES:
+                    break
+                os.unlink(path)
+                total_bytes -= size
+        except OSError as e:
+            logger.warning(f"Could not prune extraction cache {PDF_EXTRACTION_CACHE_DIR}: {e}")
     
     async def _extract_pdf_content_fallback(self, file_path: str) -> Dict[str, Any]:
         """Extract text content and metadata from PDF."""
         try:
+            import PyPDF2
+            
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 
@@ -309,7 +558,7 @@ class PDFAgent:
                 "structured_content": {}
             }
     
-    async def _extract_page_content(self, page, page_num: int) -> Dict[str, Any]:
+    def _extract_page_content(self, page, page_num: int, images_dir: Path) -> Dict[str, Any]:
         """Extract comprehensive content from a single PDF page."""
         try:
             page_data = {
@@ -320,14 +569,19 @@ class PDFAgent:
                 "annotations": []
             }
             
-            # Extract text with structure
-            text_dict = page.get_text("dict")
-            page_text, text_blocks = self._process_text_structure(text_dict, page_num)
+            # Extract text with structure from PyMuPDF's flat block tuples
+            page_text, text_blocks = self._process_text_blocks(page.get_text("blocks"), page_num)
             page_data["text"] = page_text
             page_data["text_blocks"] = text_blocks
             
+            # Blank or near-blank pages (title/separator pages) have nothing for the
+            # costlier table, image and annotation passes to find
+            image_list = page.get_images()
+            if len(page_text) < MIN_CONTENT_PAGE_CHARS and not image_list and page.first_annot is None:
+                return page_data
+            
             # Extract images
-            page_data["images"] = await self._extract_page_images(page, page_num)
+            page_data["images"] = self._extract_page_images(page, page_num, images_dir, image_list)
             
             # Extract tables
             page_data["tables"] = self._extract_page_tables(page, page_num)
@@ -347,96 +601,90 @@ class PDFAgent:
                 "annotations": []
             }
     
-    def _process_text_structure(self, text_dict: Dict, page_num: int) -> Tuple[str, List[Dict]]:
-        """Process text structure to preserve formatting and hierarchy."""
+    def _process_text_blocks(self, blocks: List[Tuple], page_num: int) -> Tuple[str, List[Dict]]:
+        """Build page text and text blocks from PyMuPDF's flat ``"blocks"`` output."""
         text_blocks = []
         page_text = []
         
         try:
-            for block in text_dict.get("blocks", []):
-                if "lines" in block:  # Text block
-                    block_text = []
-                    block_info = {
+            for x0, y0, x1, y1, block_text, _block_no, block_type in blocks:
+                if block_type != 0:  # Image block
+                    continue
+                
+                lines = [line.strip() for line in block_text.splitlines()]
+                block_content = "\n".join(line for line in lines if line)
+                if block_content:
+                    text_blocks.append({
                         "type": "text",
                         "page": page_num,
-                        "bbox": block.get("bbox", []),
-                        "content": "",
-                        "font_info": []
-                    }
-                    
-                    for line in block["lines"]:
-                        line_text = []
-                        for span in line.get("spans", []):
-                            span_text = span.get("text", "").strip()
-                            if span_text:
-                                line_text.append(span_text)
-                                
-                                # Collect font information
-                                font_info = {
-                                    "font": span.get("font", ""),
-                                    "size": span.get("size", 0),
-                                    "flags": span.get("flags", 0),
-                                    "color": span.get("color", 0)
-                                }
-                                block_info["font_info"].append(font_info)
-                        
-                        if line_text:
-                            block_text.append(" ".join(line_text))
-                    
-                    if block_text:
-                        block_content = "\n".join(block_text)
-                        block_info["content"] = block_content
-                        text_blocks.append(block_info)
-                        page_text.append(block_content)
+                        "bbox": [x0, y0, x1, y1],
+                        "content": block_content
+                    })
+                    page_text.append(block_content)
             
             return "\n\n".join(page_text), text_blocks
             
         except Exception as e:
-            logger.error(f"Error processing text structure for page {page_num}: {e}")
+            logger.error(f"Error processing text blocks for page {page_num}: {e}")
             return "", []
     
-    async def _extract_page_images(self, page, page_num: int) -> List[Dict[str, Any]]:
-        """Extract images and diagrams from a PDF page."""
+    def _extract_page_images(self, page, page_num: int, images_dir: Path,
+                             image_list: List[Tuple]) -> List[Dict[str, Any]]:
+        """Extract images and diagrams from a PDF page, writing each one to ``images_dir``.
+        
+        ``image_list`` is the page's ``get_images()`` result, already read by the caller.
+        """
         images = []
+        pending_images = []
         
         try:
-            image_list = page.get_images()
+            # One pass over the page for every image position (first placement wins)
+            rects_by_xref = {}
+            for info in page.get_image_info(xrefs=True):
+                rects_by_xref.setdefault(info['xref'], info['bbox'])
             
             for img_index, img in enumerate(image_list):
                 try:
-                    # Get image data
+                    # Get the embedded image stream as stored in the PDF (no decode/re-encode)
                     xref = img[0]
-                    pix = fitz.Pixmap(page.parent, xref)
+                    img_dict = page.parent.extract_image(xref)
                     
-                    # Convert to PIL Image for processing
-                    if pix.n - pix.alpha < 4:  # GRAY or RGB
+                    if img_dict and img_dict.get("image") and img_dict.get("ext") in EXTRACTABLE_IMAGE_FORMATS:
+                        img_data = img_dict["image"]
+                        img_format = img_dict["ext"].upper()
+                        width, height = img_dict["width"], img_dict["height"]
+                    else:
+                        # Unsupported stream filter (e.g. JBIG2, JPX): decode through a Pixmap
+                        import fitz
+                        pix = fitz.Pixmap(page.parent, xref)
+                        if pix.n - pix.alpha >= 4:  # CMYK and other non GRAY/RGB colorspaces
+                            pix = fitz.Pixmap(fitz.csRGB, pix)
                         img_data = pix.tobytes("png")
-                        pil_image = Image.open(io.BytesIO(img_data))
-                        
-                        # Convert to base64 for storage
-                        buffered = io.BytesIO()
-                        pil_image.save(buffered, format="PNG")
-                        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-                        
-                        # Get image position on page
-                        img_rects = page.get_image_rects(xref)
-                        bbox = img_rects[0] if img_rects else [0, 0, 0, 0]
-                        
-                        image_info = {
-                            "page": page_num,
-                            "index": img_index,
-                            "xref": xref,
-                            "bbox": list(bbox),
-                            "width": pil_image.width,
-                            "height": pil_image.height,
-                            "format": "PNG",
-                            "data": img_base64,
-                            "size_bytes": len(img_data)
-                        }
-                        
-                        images.append(image_info)
+                        img_format = "PNG"
+                        width, height = pix.width, pix.height
+                        pix = None  # Clean up
+                    
+                    # Stream to disk so memory stays bounded regardless of page count. The
+                    # document handle belongs to this thread, so only the byte handling is
+                    # handed to the shared pool while the next image is pulled from the PDF.
+                    out_path = images_dir / f"p{page_num}_i{img_index}.{img_format.lower()}"
+                    store_future = IMAGE_IO_EXECUTOR.submit(out_path.write_bytes, img_data)
                     
-                    pix = None  # Clean up
+                    # Get image position on page
+                    bbox = rects_by_xref.get(xref, [0, 0, 0, 0])
+                    
+                    image_info = {
+                        "page": page_num,
+                        "index": img_index,
+                        "xref": xref,
+                        "bbox": list(bbox),
+                        "width": width,
+                        "height": height,
+                        "format": img_format,
+                        "path": str(out_path),
+                        "size_bytes": len(img_data)
+                    }
+                    pending_images.append((image_info, store_future))
                     
                 except Exception as e:
                     logger.error(f"Error extracting image {img_index} from page {page_num}: {e}")
@@ -445,6 +693,14 @@ class PDFAgent:
         except Exception as e:
             logger.error(f"Error extracting images from page {page_num}: {e}")
         
+        # Keep page order; only report images that were stored successfully
+        for image_info, store_future in pending_images:
+            try:
+                store_future.result()
+                images.append(image_info)
+            except Exception as e:
+                logger.error(f"Error storing image {image_info['index']} from page {page_num}: {e}")
+        
         return images
     
     def _extract_page_tables(self, page, page_num: int) -> List[Dict[str, Any]]:
@@ -461,8 +717,9 @@ class PDFAgent:
                     table_data = tab.extract()
                     
                     if table_data:
-                        # Convert to pandas DataFrame for structure analysis
-                        df = pd.DataFrame(table_data[1:], columns=table_data[0] if table_data else [])
+                        # Map each data row onto the header row
+                        headers = table_data[0]
+                        structured_data = [dict(zip(headers, row)) for row in table_data[1:]] if headers else []
                         
                         table_info = {
                             "page": page_num,
@@ -471,8 +728,8 @@ class PDFAgent:
                             "rows": len(table_data),
                             "columns": len(table_data[0]) if table_data else 0,
                             "data": table_data,
-                            "structured_data": df.to_dict('records') if not df.empty else [],
-                            "headers": table_data[0] if table_data else [],
+                            "structured_data": structured_data,
+                            "headers": headers,
                             "confidence": getattr(tab, 'confidence', 0.8)  # Default confidence
                         }
                         
@@ -596,31 +853,48 @@ class PDFAgent:
         }
         
         try:
-            import re
-            
-            full_text = " ".join(text_pages)
-            
-            # Detect figure references
-            fig_refs = re.findall(r'(?:Figure|Fig\.?)\s+(\d+(?:\.\d+)?)', full_text, re.IGNORECASE)
-            cross_refs["figures"] = list(set(fig_refs))
+            # Single scan over each page in place (no joined copy of the document) for
+            # figure, table, section and page references, plus the page seams
+            found = {kind: set() for kind in cross_refs}
+            for match in self._iter_cross_reference_matches(text_pages):
+                kind = next(k for k in cross_refs if match.group(k))
+                number = match.group("number")
+                if kind == "pages":
+                    number = number.partition('.')[0]  # Page references are whole numbers
+                found[kind].add(number)
             
-            # Detect table references
-            table_refs = re.findall(r'(?:Table|Tbl\.?)\s+(\d+(?:\.\d+)?)', full_text, re.IGNORECASE)
-            cross_refs["tables"] = list(set(table_refs))
-            
-            # Detect section references
-            section_refs = re.findall(r'(?:Section|Sec\.?)\s+(\d+(?:\.\d+)?)', full_text, re.IGNORECASE)
-            cross_refs["sections"] = list(set(section_refs))
-            
-            # Detect page references
-            page_refs = re.findall(r'(?:page|p\.?)\s+(\d+)', full_text, re.IGNORECASE)
-            cross_refs["pages"] = list(set(page_refs))
+            for kind, numbers in found.items():
+                cross_refs[kind] = list(numbers)
             
         except Exception as e:
             logger.error(f"Error detecting cross-references: {e}")
         
         return cross_refs
     
+    def _iter_cross_reference_matches(self, text_pages: List[str]):
+        """Yield the reference matches a scan of ``" ".join(text_pages)`` would find.
+        
+        Each page is scanned on its own. Matches that cross a page break are found
+        in a short window around the break, made of the preceding text and the start
+        of the next page, joined by a space as the full join would.
+        """
+        tail = ""
+        for page_text in text_pages:
+            if tail:
+                seam = f"{tail} {page_text[:CROSS_REFERENCE_SEAM_CHARS]}"
+                for match in CROSS_REFERENCE_PATTERN.finditer(seam):
+                    # Matches on only one side of the break are found by the page scans
+                    if match.start() < len(tail) < match.end():
+                        yield match
+            
+            yield from CROSS_REFERENCE_PATTERN.finditer(page_text)
+            
+            # Short pages keep earlier text in the window so breaks spanning them still join up
+            if len(page_text) >= CROSS_REFERENCE_SEAM_CHARS:
+                tail = page_text[-CROSS_REFERENCE_SEAM_CHARS:]
+            else:
+                tail = f"{tail} {page_text}"[-CROSS_REFERENCE_SEAM_CHARS:]
+    
     async def _analyze_content_with_model(self, content: str, file_path: str, 
                                          metadata: Dict[str, Any], images: List[Dict], 
                                          tables: List[Dict]) -> Dict[str, Any]:
@@ -648,7 +922,7 @@ Images extracted: {len(images)}
 Tables extracted: {len(tables)}
 Has outline: {metadata.get('has_outline', False)}
 
-Content Preview: {content[:3000]}...
+Content Preview: {self._truncate_at_sentence(content, PROMPT_PREVIEW_CHARS)}...
 
 {"Table summaries:" if tables else ""}
 {self._summarize_tables(tables[:3]) if tables else ""}
@@ -676,19 +950,18 @@ Please provide a comprehensive analysis including:
 Format as structured JSON with clear categories and confidence scores where applicable.
 """
             
-            response = self.bedrock_client.invoke_model(
-                modelId=model_id,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
+            # Run the blocking HTTP call on a worker thread so analyses of several PDFs
+            # (gathered by the agent manager) overlap their network round-trips
+            analysis_text = await asyncio.to_thread(
+                self._invoke_bedrock,
+                model_id,
+                {
                     "max_tokens": max_tokens,
                     "temperature": temperature,
                     "messages": [{"role": "user", "content": prompt}]
-                })
+                }
             )
             
-            result = json.loads(response['body'].read())
-            analysis_text = result['content'][0]['text']
-            
             return {
                 "ai_analysis": analysis_text,
                 "content_type": "enhanced_pdf_document",
@@ -721,6 +994,16 @@ Format as structured JSON with clear categories and confidence scores where appl
             # For other errors, try fallback analysis
             return await self._analyze_content_fallback(content, file_path, metadata)
     
+    def _truncate_at_sentence(self, content: str, max_chars: int) -> str:
+        """Cut content to at most ``max_chars``, ending on a sentence boundary when one is near."""
+        if len(content) <= max_chars:
+            return content
+        
+        preview = content[:max_chars]
+        # Only back off to a sentence end if that keeps most of the budget
+        sentence_end = preview.rfind('.', max_chars // 2)
+        return preview[:sentence_end + 1] if sentence_end != -1 else preview
+    
     def _summarize_tables(self, tables: List[Dict]) -> str:
         """Create a summary of extracted tables for analysis."""
         try:
@@ -788,18 +1071,15 @@ Please provide:
 Format as JSON with clear categories.
 """
             
-            response = self.bedrock_client.invoke_model(
-                modelId=os.getenv("BEDROCK_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20241022-v2:0"),
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
+            analysis_text = await asyncio.to_thread(
+                self._invoke_bedrock,
+                os.getenv("BEDROCK_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20241022-v2:0"),
+                {
                     "max_tokens": 1200,
                     "messages": [{"role": "user", "content": prompt}]
-                })
+                }
             )
             
-            result = json.loads(response['body'].read())
-            analysis_text = result['content'][0]['text']
-            
             return {
                 "ai_analysis": analysis_text,
                 "content_type": "pdf_document",
@@ -828,214 +1108,196 @@ Format as JSON with clear categories.
             "cross_page_relationships": []
         }
         
+        if not text_pages:
+            return correlation_data
+        
         try:
+            # Lowercase each page once for every case-insensitive pass below
+            text_pages_lower = [page_text.lower() for page_text in text_pages]
+            
+            # Scan every page for figure/table/section references up front
+            page_references = await self._scan_page_references(text_pages)
+            
+            # Index images and tables by page once for all resolvers
+            images_by_page = {}
+            for img in images:
+                images_by_page.setdefault(img['page'], []).append(img)
+            tables_by_page = {}
+            for table in tables:
+                tables_by_page.setdefault(table['page'], []).append(table)
+            
             # Resolve figure references
-            correlation_data["figure_references"] = self._resolve_figure_references(text_pages, images)
+            correlation_data["figure_references"] = self._resolve_figure_references(
+                text_pages, text_pages_lower, images_by_page, page_references
+            )
             
             # Resolve table references
-            correlation_data["table_references"] = self._resolve_table_references(text_pages, tables)
+            correlation_data["table_references"] = self._resolve_table_references(
+                text_pages, text_pages_lower, tables_by_page, page_references
+            )
             
             # Resolve section references
-            correlation_data["section_references"] = self._resolve_section_references(text_pages, pages)
-            
-            # Analyze content flow between pages
-            correlation_data["content_flow"] = self._analyze_content_flow(text_pages)
+            correlation_data["section_references"] = self._resolve_section_references(
+                text_pages, pages, page_references
+            )
             
             # Detect topic continuity across pages
-            correlation_data["topic_continuity"] = await self._detect_topic_continuity(text_pages)
+            correlation_data["topic_continuity"] = await self._detect_topic_continuity(text_pages_lower)
             
-            # Identify cross-page relationships
-            correlation_data["cross_page_relationships"] = self._identify_cross_page_relationships(
-                pages, images, tables
-            )
+            # Flow and relationships only exist between pages
+            if len(text_pages) > 1:
+                # Analyze content flow between pages
+                correlation_data["content_flow"] = self._analyze_content_flow(text_pages_lower)
+                
+                # Identify cross-page relationships
+                correlation_data["cross_page_relationships"] = self._identify_cross_page_relationships(
+                    pages, images_by_page, tables_by_page
+                )
             
         except Exception as e:
             logger.error(f"Error correlating cross-page content: {e}")
         
         return correlation_data
     
-    def _resolve_figure_references(self, text_pages: List[str], images: List[Dict]) -> Dict[str, Any]:
-        """Resolve figure references to actual images in the document."""
-        import re
+    async def _scan_page_references(self, text_pages: List[str]) -> List[Dict[str, List[Tuple[str, int, str]]]]:
+        """Scan pages for references, moving long documents off the event loop."""
+        if len(text_pages) < THREADED_REFERENCE_SCAN_MIN_PAGES:
+            return scan_pages_references(text_pages)
         
+        # A regex pass is far cheaper than starting processes and pickling every page to them
+        return await asyncio.to_thread(scan_pages_references, text_pages)
+    
+    def _resolve_figure_references(self, text_pages: List[str], text_pages_lower: List[str],
+                                   images_by_page: Dict[int, List[Dict]],
+                                   page_references: List[Dict[str, List[Tuple[str, int, str]]]]) -> Dict[str, Any]:
+        """Resolve figure references to actual images in the document."""
         figure_refs = {}
         
         try:
-            # Create mapping of images by page
-            images_by_page = {}
-            for img in images:
-                page_num = img['page']
-                if page_num not in images_by_page:
-                    images_by_page[page_num] = []
-                images_by_page[page_num].append(img)
-            
             # Find figure references in text
-            for page_idx, page_text in enumerate(text_pages):
+            for page_idx, (page_text_lower, references) in enumerate(zip(text_pages_lower, page_references)):
+                if not references["figures"]:
+                    continue
                 page_num = page_idx + 1
                 
-                # Find all figure references on this page
-                fig_matches = re.finditer(r'(?:Figure|Fig\.?)\s+(\d+(?:\.\d+)?)', page_text, re.IGNORECASE)
+                # Try to find corresponding image; the lookup depends only on the referring page
+                resolved_image = self._find_corresponding_image(page_num, images_by_page)
                 
-                for match in fig_matches:
-                    fig_number = match.group(1)
-                    ref_position = match.start()
-                    
-                    # Try to find corresponding image
-                    resolved_image = self._find_corresponding_image(
-                        fig_number, page_num, images_by_page, text_pages
-                    )
-                    
-                    if fig_number not in figure_refs:
-                        figure_refs[fig_number] = {
-                            "references": [],
+                for fig_number, ref_position, match_text in references["figures"]:
+                    ref = figure_refs.get(fig_number)
+                    if ref is None:
+                        ref = figure_refs[fig_number] = {
+                            "pages": array('i'),
+                            "positions": array('i'),
                             "resolved_image": resolved_image,
                             "confidence": 0.0
                         }
                     
-                    figure_refs[fig_number]["references"].append({
-                        "page": page_num,
-                        "position": ref_position,
-                        "context": page_text[max(0, ref_position-100):ref_position+100]
-                    })
+                    ref["pages"].append(page_num)
+                    ref["positions"].append(ref_position)
                     
-                    # Calculate confidence based on proximity and context
-                    if resolved_image:
+                    # Calculate confidence based on proximity and context; nothing to gain once it is at the 1.0 cap
+                    if resolved_image and ref["confidence"] < 1.0:
                         confidence = self._calculate_reference_confidence(
-                            page_num, resolved_image['page'], match.group(0), page_text
-                        )
-                        figure_refs[fig_number]["confidence"] = max(
-                            figure_refs[fig_number]["confidence"], confidence
+                            page_num, resolved_image['page'], match_text, page_text_lower
                         )
+                        if confidence > ref["confidence"]:
+                            ref["confidence"] = confidence
         
         except Exception as e:
             logger.error(f"Error resolving figure references: {e}")
         
-        return figure_refs
+        return self._materialize_references(figure_refs, text_pages)
     
-    def _resolve_table_references(self, text_pages: List[str], tables: List[Dict]) -> Dict[str, Any]:
+    def _resolve_table_references(self, text_pages: List[str], text_pages_lower: List[str],
+                                  tables_by_page: Dict[int, List[Dict]],
+                                  page_references: List[Dict[str, List[Tuple[str, int, str]]]]) -> Dict[str, Any]:
         """Resolve table references to actual tables in the document."""
-        import re
-        
         table_refs = {}
         
         try:
-            # Create mapping of tables by page
-            tables_by_page = {}
-            for table in tables:
-                page_num = table['page']
-                if page_num not in tables_by_page:
-                    tables_by_page[page_num] = []
-                tables_by_page[page_num].append(table)
-            
             # Find table references in text
-            for page_idx, page_text in enumerate(text_pages):
+            for page_idx, (page_text_lower, references) in enumerate(zip(text_pages_lower, page_references)):
+                if not references["tables"]:
+                    continue
                 page_num = page_idx + 1
                 
-                # Find all table references on this page
-                table_matches = re.finditer(r'(?:Table|Tbl\.?)\s+(\d+(?:\.\d+)?)', page_text, re.IGNORECASE)
+                # Try to find corresponding table; the lookup depends only on the referring page
+                resolved_table = self._find_corresponding_table(page_num, tables_by_page)
                 
-                for match in table_matches:
-                    table_number = match.group(1)
-                    ref_position = match.start()
-                    
-                    # Try to find corresponding table
-                    resolved_table = self._find_corresponding_table(
-                        table_number, page_num, tables_by_page, text_pages
-                    )
-                    
-                    if table_number not in table_refs:
-                        table_refs[table_number] = {
-                            "references": [],
+                for table_number, ref_position, match_text in references["tables"]:
+                    ref = table_refs.get(table_number)
+                    if ref is None:
+                        ref = table_refs[table_number] = {
+                            "pages": array('i'),
+                            "positions": array('i'),
                             "resolved_table": resolved_table,
                             "confidence": 0.0
                         }
                     
-                    table_refs[table_number]["references"].append({
-                        "page": page_num,
-                        "position": ref_position,
-                        "context": page_text[max(0, ref_position-100):ref_position+100]
-                    })
+                    ref["pages"].append(page_num)
+                    ref["positions"].append(ref_position)
                     
-                    # Calculate confidence
-                    if resolved_table:
+                    # Calculate confidence; nothing to gain once it is at the 1.0 cap
+                    if resolved_table and ref["confidence"] < 1.0:
                         confidence = self._calculate_reference_confidence(
-                            page_num, resolved_table['page'], match.group(0), page_text
-                        )
-                        table_refs[table_number]["confidence"] = max(
-                            table_refs[table_number]["confidence"], confidence
+                            page_num, resolved_table['page'], match_text, page_text_lower
                         )
+                        if confidence > ref["confidence"]:
+                            ref["confidence"] = confidence
         
         except Exception as e:
             logger.error(f"Error resolving table references: {e}")
         
-        return table_refs
+        return self._materialize_references(table_refs, text_pages)
     
-    def _resolve_section_references(self, text_pages: List[str], pages: List[Dict]) -> Dict[str, Any]:
+    def _resolve_section_references(self, text_pages: List[str], pages: List[Dict],
+                                    page_references: List[Dict[str, List[Tuple[str, int, str]]]]) -> Dict[str, Any]:
         """Resolve section references to actual sections in the document."""
-        import re
-        
         section_refs = {}
         
         try:
-            # Extract section headings from pages
-            section_headings = self._extract_section_headings(pages)
+            # Index section headings by number, keeping the first heading for each
+            headings_by_number = {}
+            for heading in self._extract_section_headings(pages):
+                headings_by_number.setdefault(heading["number"], heading)
             
             # Find section references in text
-            for page_idx, page_text in enumerate(text_pages):
+            for page_idx, references in enumerate(page_references):
                 page_num = page_idx + 1
                 
-                # Find section references
-                section_matches = re.finditer(
-                    r'(?:Section|Sec\.?|Chapter|Ch\.?)\s+(\d+(?:\.\d+)?)', 
-                    page_text, re.IGNORECASE
-                )
-                
-                for match in section_matches:
-                    section_number = match.group(1)
-                    ref_position = match.start()
-                    
-                    # Try to find corresponding section
-                    resolved_section = self._find_corresponding_section(
-                        section_number, section_headings
-                    )
-                    
-                    if section_number not in section_refs:
-                        section_refs[section_number] = {
-                            "references": [],
+                for section_number, ref_position, match_text in references["sections"]:
+                    ref = section_refs.get(section_number)
+                    if ref is None:
+                        # Try to find corresponding section; high confidence when one exists
+                        resolved_section = headings_by_number.get(section_number)
+                        ref = section_refs[section_number] = {
+                            "pages": array('i'),
+                            "positions": array('i'),
                             "resolved_section": resolved_section,
-                            "confidence": 0.0
+                            "confidence": 0.8 if resolved_section else 0.0
                         }
                     
-                    section_refs[section_number]["references"].append({
-                        "page": page_num,
-                        "position": ref_position,
-                        "context": page_text[max(0, ref_position-100):ref_position+100]
-                    })
-                    
-                    # Calculate confidence
-                    if resolved_section:
-                        confidence = 0.8  # High confidence for section references
-                        section_refs[section_number]["confidence"] = max(
-                            section_refs[section_number]["confidence"], confidence
-                        )
+                    ref["pages"].append(page_num)
+                    ref["positions"].append(ref_position)
         
         except Exception as e:
             logger.error(f"Error resolving section references: {e}")
         
-        return section_refs
+        return self._materialize_references(section_refs, text_pages)
     
-    def _analyze_content_flow(self, text_pages: List[str]) -> List[Dict[str, Any]]:
-        """Analyze how content flows between pages."""
+    def _analyze_content_flow(self, text_pages_lower: List[str]) -> List[Dict[str, Any]]:
+        """Analyze how content flows between (lowercased) pages."""
         content_flow = []
         
         try:
-            for i in range(len(text_pages) - 1):
-                current_page = text_pages[i]
-                next_page = text_pages[i + 1]
+            for i in range(len(text_pages_lower) - 1):
+                current_page = text_pages_lower[i]
+                next_page = text_pages_lower[i + 1]
                 
                 # Analyze sentence continuity
-                current_sentences = current_page.split('.')[-3:]  # Last 3 sentences
-                next_sentences = next_page.split('.')[:3]  # First 3 sentences
+                current_sentences = self._last_sentences(current_page, 3)
+                next_sentences = self._first_sentences(next_page, 3)
                 
                 # Check for continuation indicators
                 continuation_score = self._calculate_continuation_score(
@@ -1059,18 +1321,16 @@ Format as JSON with clear categories.
         
         return content_flow
     
-    async def _detect_topic_continuity(self, text_pages: List[str]) -> List[Dict[str, Any]]:
-        """Detect topic continuity and changes across pages."""
+    async def _detect_topic_continuity(self, text_pages_lower: List[str]) -> List[Dict[str, Any]]:
+        """Detect topic continuity and changes across (lowercased) pages."""
         topic_continuity = []
         
         try:
-            # Simple keyword-based topic detection
-            for i in range(len(text_pages)):
-                page_text = text_pages[i]
-                
-                # Extract key terms from page
-                key_terms = self._extract_key_terms(page_text)
-                
+            # Simple keyword-based topic detection: extract key terms for every page first
+            key_terms_list = [list(extract_key_terms(page_text)) for page_text in text_pages_lower]
+            term_sets = [frozenset(key_terms) for key_terms in key_terms_list]
+            
+            for i, key_terms in enumerate(key_terms_list):
                 topic_info = {
                     "page": i + 1,
                     "key_terms": key_terms,
@@ -1080,8 +1340,7 @@ Format as JSON with clear categories.
                 
                 # Compare with previous page
                 if i > 0:
-                    prev_terms = topic_continuity[i-1]["key_terms"]
-                    similarity = self._calculate_term_similarity(key_terms, prev_terms)
+                    similarity = self._calculate_set_similarity(term_sets[i], term_sets[i - 1])
                     topic_info["topic_similarity"] = similarity
                     topic_info["topic_change"] = similarity < 0.3  # Threshold for topic change
                 
@@ -1092,39 +1351,39 @@ Format as JSON with clear categories.
         
         return topic_continuity
     
-    def _identify_cross_page_relationships(self, pages: List[Dict], images: List[Dict], 
-                                         tables: List[Dict]) -> List[Dict[str, Any]]:
+    def _identify_cross_page_relationships(self, pages: List[Dict], images_by_page: Dict[int, List[Dict]], 
+                                         tables_by_page: Dict[int, List[Dict]]) -> List[Dict[str, Any]]:
         """Identify relationships between content elements across pages."""
         relationships = []
         
         try:
-            # Group content by type and page
-            content_by_page = {}
-            for page_info in pages:
-                page_num = page_info["page_number"]
-                content_by_page[page_num] = {
-                    "images": [img for img in images if img["page"] == page_num],
-                    "tables": [tbl for tbl in tables if tbl["page"] == page_num],
-                    "text_blocks": page_info.get("text_blocks", [])
-                }
+            # Index tables by structure and images by width bucket, per page
+            table_index_by_page = {}
+            for page_num, page_tables in tables_by_page.items():
+                index = table_index_by_page[page_num] = {}
+                for table in page_tables:
+                    index.setdefault(self._table_structure_key(table), table)
+            
+            image_buckets_by_page = {}
+            for page_num, page_images in images_by_page.items():
+                buckets = image_buckets_by_page[page_num] = {}
+                for img in page_images:
+                    buckets.setdefault(img.get('width', 0) // FIGURE_WIDTH_TOLERANCE, []).append(img)
             
             # Find relationships between adjacent pages
             for page_num in range(1, len(pages)):
-                current_page = content_by_page.get(page_num, {})
-                next_page = content_by_page.get(page_num + 1, {})
-                
                 # Check for split tables
                 split_table_rel = self._check_split_tables(
-                    current_page.get("tables", []), 
-                    next_page.get("tables", [])
+                    tables_by_page.get(page_num, []), 
+                    table_index_by_page.get(page_num + 1, {})
                 )
                 if split_table_rel:
                     relationships.append(split_table_rel)
                 
                 # Check for continued figures/diagrams
                 figure_continuation = self._check_figure_continuation(
-                    current_page.get("images", []), 
-                    next_page.get("images", [])
+                    images_by_page.get(page_num, []), 
+                    image_buckets_by_page.get(page_num + 1, {})
                 )
                 if figure_continuation:
                     relationships.append(figure_continuation)
@@ -1143,20 +1402,25 @@ Format as JSON with clear categories.
         }
         
         try:
+            # Bucket outline items by the page they point to, tracking each page's top level
+            outline_by_page = {}
+            level_by_page = {}
+            for item in outline:
+                page_num = item.get("page")
+                outline_by_page.setdefault(page_num, []).append(item)
+                level = item.get("level", 999)
+                if page_num not in level_by_page or level < level_by_page[page_num]:
+                    level_by_page[page_num] = level
+            
             # Create page hierarchy based on outline
             for page_info in pages:
                 page_num = page_info["page_number"]
-                
-                # Find outline items that point to this page
-                outline_items = [
-                    item for item in outline 
-                    if item.get("page") == page_num
-                ]
+                outline_items = outline_by_page.get(page_num, [])
                 
                 hierarchy_info = {
                     "page": page_num,
                     "outline_items": outline_items,
-                    "section_level": min([item.get("level", 999) for item in outline_items]) if outline_items else 999,
+                    "section_level": level_by_page.get(page_num, 999),
                     "is_section_start": len(outline_items) > 0
                 }
                 
@@ -1172,9 +1436,26 @@ Format as JSON with clear categories.
     
     # Helper methods for cross-page correlation
     
-    def _find_corresponding_image(self, fig_number: str, ref_page: int, 
-                                images_by_page: Dict, text_pages: List[str]) -> Optional[Dict]:
-        """Find the image that corresponds to a figure reference."""
+    def _materialize_references(self, refs: Dict[str, Dict[str, Any]], text_pages: List[str]) -> Dict[str, Any]:
+        """Turn the compact page/position arrays collected while scanning into reference dicts.
+        
+        The 200-character context around each reference is only sliced here, once the
+        references are final, instead of being copied for every match during the scan.
+        """
+        for number, ref in refs.items():
+            references = [
+                {
+                    "page": page,
+                    "position": position,
+                    "context": text_pages[page - 1][max(0, position - 100):position + 100]
+                }
+                for page, position in zip(ref.pop("pages"), ref.pop("positions"))
+            ]
+            refs[number] = {"references": references, **ref}
+        return refs
+    
+    def _find_corresponding_image(self, ref_page: int, images_by_page: Dict) -> Optional[Dict]:
+        """Find the image that corresponds to a figure reference on ref_page."""
         # Look for image on same page first
         if ref_page in images_by_page:
             return images_by_page[ref_page][0] if images_by_page[ref_page] else None
@@ -1187,9 +1468,8 @@ Format as JSON with clear categories.
         
         return None
     
-    def _find_corresponding_table(self, table_number: str, ref_page: int, 
-                                tables_by_page: Dict, text_pages: List[str]) -> Optional[Dict]:
-        """Find the table that corresponds to a table reference."""
+    def _find_corresponding_table(self, ref_page: int, tables_by_page: Dict) -> Optional[Dict]:
+        """Find the table that corresponds to a table reference on ref_page."""
         # Look for table on same page first
         if ref_page in tables_by_page:
             return tables_by_page[ref_page][0] if tables_by_page[ref_page] else None
@@ -1202,18 +1482,8 @@ Format as JSON with clear categories.
         
         return None
     
-    def _find_corresponding_section(self, section_number: str, 
-                                  section_headings: List[Dict]) -> Optional[Dict]:
-        """Find the section that corresponds to a section reference."""
-        for section in section_headings:
-            if section.get("number") == section_number:
-                return section
-        return None
-    
     def _extract_section_headings(self, pages: List[Dict]) -> List[Dict]:
         """Extract section headings from page content."""
-        import re
-        
         headings = []
         
         for page_info in pages:
@@ -1222,8 +1492,14 @@ Format as JSON with clear categories.
             for block in text_blocks:
                 content = block.get("content", "")
                 
+                # Numbered headings start with a digit (possibly after whitespace); skip other blocks
+                # before running the regex
+                first_char = content[:1]
+                if not (first_char.isdigit() or first_char.isspace()):
+                    continue
+                
                 # Look for numbered headings
-                heading_match = re.match(r'^(\d+(?:\.\d+)*)\s+(.+)$', content.strip())
+                heading_match = SECTION_HEADING_PATTERN.match(content)
                 if heading_match:
                     headings.append({
                         "number": heading_match.group(1),
@@ -1235,8 +1511,8 @@ Format as JSON with clear categories.
         return headings
     
     def _calculate_reference_confidence(self, ref_page: int, target_page: int, 
-                                      ref_text: str, context: str) -> float:
-        """Calculate confidence score for a reference resolution."""
+                                      ref_text: str, context_lower: str) -> float:
+        """Calculate confidence score for a reference resolution from lowercased context."""
         confidence = 0.5  # Base confidence
         
         # Same page = high confidence
@@ -1250,11 +1526,37 @@ Format as JSON with clear categories.
             confidence += 0.1
         
         # Check for contextual indicators
-        if any(word in context.lower() for word in ['above', 'below', 'following', 'preceding']):
+        if any(word in context_lower for word in ['above', 'below', 'following', 'preceding']):
             confidence += 0.1
         
         return min(confidence, 1.0)
     
+    def _last_sentences(self, text: str, count: int) -> List[str]:
+        """Same as text.split('.')[-count:] without splitting the whole page."""
+        sentences = []
+        end = len(text)
+        for _ in range(count):
+            dot = text.rfind('.', 0, end)
+            sentences.append(text[dot + 1:end])
+            if dot < 0:
+                break
+            end = dot
+        sentences.reverse()
+        return sentences
+    
+    def _first_sentences(self, text: str, count: int) -> List[str]:
+        """Same as text.split('.')[:count] without splitting the whole page."""
+        sentences = []
+        start = 0
+        for _ in range(count):
+            dot = text.find('.', start)
+            if dot < 0:
+                sentences.append(text[start:])
+                break
+            sentences.append(text[start:dot])
+            start = dot + 1
+        return sentences
+    
     def _calculate_continuation_score(self, current_sentences: List[str], 
                                     next_sentences: List[str]) -> float:
         """Calculate how likely content continues from one page to the next."""
@@ -1269,9 +1571,8 @@ Format as JSON with clear categories.
             score += 0.5
         
         # Check for continuation words
-        first_sentence = next_sentences[0].strip().lower()
-        continuation_words = ['however', 'therefore', 'furthermore', 'moreover', 'additionally']
-        if any(first_sentence.startswith(word) for word in continuation_words):
+        first_sentence = next_sentences[0].strip()
+        if first_sentence.startswith(CONTINUATION_WORDS):
             score += 0.3
         
         return min(score, 1.0)
@@ -1286,86 +1587,64 @@ Format as JSON with clear categories.
             return "new_section"
     
     def _find_transition_indicators(self, page_end: str, page_start: str) -> List[str]:
-        """Find indicators of content transition between pages."""
-        indicators = []
+        """Find indicators of content transition between (lowercased) pages."""
+        # Check for common transition phrases, including ones split across the page break
+        found = {match.group(0) for match in TRANSITION_PHRASE_PATTERN.finditer(page_end + " " + page_start)}
+        if not found:
+            return []
         
-        # Check for common transition phrases
-        transition_phrases = [
-            'continued on next page', 'see next page', 'table continues',
-            'figure continues', 'to be continued'
-        ]
-        
-        combined_text = (page_end + " " + page_start).lower()
-        for phrase in transition_phrases:
-            if phrase in combined_text:
-                indicators.append(phrase)
-        
-        return indicators
-    
-    def _extract_key_terms(self, text: str) -> List[str]:
-        """Extract key terms from text for topic analysis."""
-        import re
-        
-        # Simple keyword extraction (could be enhanced with NLP)
-        words = re.findall(r'\b[A-Za-z]{4,}\b', text.lower())
-        
-        # Filter common words
-        stop_words = {'this', 'that', 'with', 'have', 'will', 'from', 'they', 'been', 'were', 'said'}
-        key_terms = [word for word in words if word not in stop_words]
-        
-        # Return most frequent terms
-        from collections import Counter
-        term_counts = Counter(key_terms)
-        return [term for term, count in term_counts.most_common(10)]
+        return [phrase for phrase in TRANSITION_PHRASES if phrase in found]
     
-    def _calculate_term_similarity(self, terms1: List[str], terms2: List[str]) -> float:
-        """Calculate similarity between two sets of terms."""
-        if not terms1 or not terms2:
+    def _calculate_set_similarity(self, set1: frozenset, set2: frozenset) -> float:
+        """Jaccard similarity of two term sets, deriving the union size from the intersection."""
+        if not set1 or not set2:
             return 0.0
         
-        set1, set2 = set(terms1), set(terms2)
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
-        
-        return intersection / union if union > 0 else 0.0
+        intersection = len(set1 & set2)
+        return intersection / (len(set1) + len(set2) - intersection)
+    
+    def _table_structure_key(self, table: Dict) -> Tuple:
+        """Hashable key for a table's column structure."""
+        return tuple(table.get('headers') or ()), table.get('columns')
     
     def _check_split_tables(self, current_tables: List[Dict], 
-                          next_tables: List[Dict]) -> Optional[Dict]:
+                          next_table_index: Dict[Tuple, Dict]) -> Optional[Dict]:
         """Check if tables are split across pages."""
-        if not current_tables or not next_tables:
+        if not current_tables or not next_table_index:
             return None
         
-        # Simple heuristic: similar column structure
+        # Simple heuristic: same column structure
         for curr_table in current_tables:
-            for next_table in next_tables:
-                if (curr_table.get('columns') == next_table.get('columns') and
-                    curr_table.get('headers') == next_table.get('headers')):
-                    return {
-                        "type": "split_table",
-                        "from_page": curr_table['page'],
-                        "to_page": next_table['page'],
-                        "confidence": 0.8
-                    }
+            next_table = next_table_index.get(self._table_structure_key(curr_table))
+            if next_table:
+                return {
+                    "type": "split_table",
+                    "from_page": curr_table['page'],
+                    "to_page": next_table['page'],
+                    "confidence": 0.8
+                }
         
         return None
     
     def _check_figure_continuation(self, current_images: List[Dict], 
-                                 next_images: List[Dict]) -> Optional[Dict]:
+                                 next_image_buckets: Dict[int, List[Dict]]) -> Optional[Dict]:
         """Check if figures continue across pages."""
-        if not current_images or not next_images:
+        if not current_images or not next_image_buckets:
             return None
         
-        # Simple heuristic: similar image sizes
+        # Simple heuristic: similar image widths, which can only sit in the same or a neighbouring bucket
         for curr_img in current_images:
-            for next_img in next_images:
-                size_diff = abs(curr_img.get('width', 0) - next_img.get('width', 0))
-                if size_diff < 50:  # Similar width
-                    return {
-                        "type": "figure_continuation",
-                        "from_page": curr_img['page'],
-                        "to_page": next_img['page'],
-                        "confidence": 0.6
-                    }
+            width = curr_img.get('width', 0)
+            bucket = width // FIGURE_WIDTH_TOLERANCE
+            for neighbour in (bucket - 1, bucket, bucket + 1):
+                for next_img in next_image_buckets.get(neighbour, ()):
+                    if abs(width - next_img.get('width', 0)) < FIGURE_WIDTH_TOLERANCE:
+                        return {
+                            "type": "figure_continuation",
+                            "from_page": curr_img['page'],
+                            "to_page": next_img['page'],
+                            "confidence": 0.6
+                        }
         
         return None
     
@@ -1386,60 +1665,98 @@ Format as JSON with clear categories.
         return links
 
 
+    def _iter_paragraphs(self, content: str):
+        """Yield the blank-line separated paragraphs of content without splitting it all up front."""
+        start = 0
+        while True:
+            end = content.find('\n\n', start)
+            if end == -1:
+                yield content[start:]
+                return
+            yield content[start:end]
+            start = end + 2
+    
     def _create_smart_preview(self, content: str, max_length: int = 8000) -> str:
         """Create a smart preview that preserves important content instead of simple truncation."""
         if len(content) <= max_length:
             return content
         
-        # Split content into paragraphs
-        paragraphs = content.split('\n\n')
-        
-        # Prioritize paragraphs that contain important information
+        digest = hashlib.blake2b(content.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        preview = self._preview_cache.get((digest, max_length))
+        if preview is None:
+            # Classification does not depend on max_length, so previews of different sizes share it
+            partition = self._partition_cache.get(digest)
+            if partition is None:
+                partition = self._partition_paragraphs(content)
+                self._remember(self._partition_cache, digest, partition, PARTITION_CACHE_SIZE)
+            preview = self._pack_smart_preview(len(content), *partition, max_length)
+            self._remember(self._preview_cache, (digest, max_length), preview, PREVIEW_CACHE_SIZE)
+        return preview
+    
+    def _remember(self, cache: Dict, key, value, max_entries: int) -> None:
+        """Store value in a small insertion-ordered cache, evicting the oldest entry when full."""
+        if len(cache) >= max_entries:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = value
+    
+    def _partition_paragraphs(self, content: str) -> Tuple[List[Tuple[int, int, str]], List[Tuple[str, int]]]:
+        """Split content into important paragraphs, sorted shortest first, and regular ones in document order."""
         important_paragraphs = []
         regular_paragraphs = []
         
-        for para in paragraphs:
+        for position, para in enumerate(self._iter_paragraphs(content)):
             para = para.strip()
             if not para:
                 continue
+            para_length = len(para)
             
-            # Check if paragraph contains important keywords or patterns
-            if (any(keyword in para.lower() for keyword in 
-                   ['abstract', 'introduction', 'conclusion', 'summary', 'important', 'key', 
-                    'definition', 'overview', 'objective', 'goal', 'purpose', 'main', 'primary', 
-                    'essential', 'figure', 'table', 'chapter', 'section']) or
-                para.startswith('#') or  # Headings
-                ':' in para[:100] or  # Likely definitions or key points
-                len(para.split()) < 50):  # Short paragraphs are often important
-                important_paragraphs.append(para)
+            # Check if paragraph contains important patterns or keywords, cheapest tests first
+            if (para.startswith('#') or  # Headings
+                para.find(':', 0, 100) != -1 or  # Likely definitions or key points
+                PREVIEW_KEYWORD_PATTERN.search(para) or
+                len(para.split(None, 49)) < 50):  # Short paragraphs are often important; stop splitting at 50 words
+                important_paragraphs.append((para_length, position, para))
             else:
-                regular_paragraphs.append(para)
-        
-        # Build preview starting with important paragraphs
-        preview_parts = []
-        current_length = 0
+                regular_paragraphs.append((para, para_length))
         
-        # Add important paragraphs first
-        for para in important_paragraphs:
-            if current_length + len(para) > max_length:
-                break
-            preview_parts.append(para)
-            current_length += len(para) + 2  # +2 for \n\n
-        
-        # Add regular paragraphs until we reach the limit
-        for para in regular_paragraphs:
-            if current_length + len(para) > max_length:
+        # Shortest first (document order on ties) so a long paragraph cannot crowd out many short ones
+        important_paragraphs.sort(key=lambda item: item[:2])
+        return important_paragraphs, regular_paragraphs
+    
+    def _pack_smart_preview(self, content_length: int, important_paragraphs: List[Tuple[int, int, str]],
+                            regular_paragraphs: List[Tuple[str, int]], max_length: int) -> str:
+        """Pick important paragraphs first, then regular ones, up to max_length characters."""
+        budget = max_length
+        
+        # Take the shortest important paragraphs that fit, then restore document order
+        chosen = []
+        for para_length, position, para in important_paragraphs:
+            if para_length > budget:
                 break
-            preview_parts.append(para)
-            current_length += len(para) + 2
-        
-        # If we still have space, add a truncation indicator
-        result = '\n\n'.join(preview_parts)
-        if len(content) > len(result):
-            result += f"\n\n[Content continues... {len(content) - len(result)} more characters]"
-        
-        return result
-
+            chosen.append((position, para))
+            budget -= para_length + 2  # +2 for \n\n
+        chosen.sort()
+        preview_parts = [para for _, para in chosen]
+        
+        # Add regular paragraphs until we reach the limit, unless important ones used it all
+        if budget > 0:
+            fitting = 0
+            for _, para_length in regular_paragraphs:
+                if para_length > budget:
+                    break
+                budget -= para_length + 2
+                fitting += 1
+            # One extend sized up front instead of growing the list per paragraph
+            preview_parts.extend([para for para, _ in regular_paragraphs[:fitting]])
+        
+        # Add the truncation indicator as a final part so the preview is joined in one allocation
+        remaining = content_length - (max_length - budget - 2 if preview_parts else 0)
+        if remaining > 0:
+            if not preview_parts:
+                preview_parts.append('')  # Indicator still follows a paragraph break
+            preview_parts.append(f"[Content continues... {remaining} more characters]")
+        
+        return '\n\n'.join(preview_parts)
 
 # Global instance
 pdf_agent = PDFAgent()
\ No newline at end of file
@@ -4,12 +4,16 @@ Handles: TXT, DOCX, DOC, PPTX, PPT, RTF, ODT files
 Enhanced with advanced structure analysis and key concept extraction
 """
 import os
+import asyncio
+import hashlib
 import json
 import logging
 import re
-from typing import Dict, Any, List, Optional, Tuple
+import string
+from collections import Counter
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from pathlib import Path
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 import docx
 from pptx import Presentation
 import boto3
@@ -17,6 +21,77 @@ import boto3
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Heading shapes in one alternation: ALL CAPS, numbered, Title Case, Markdown
+HEADING_SHAPES = r'[A-Z][A-Z\s]+$|\d+\.\s+[A-Z]|[A-Z][a-z]+(?:\s[A-Z][a-z]+)*$|#+\s+'
+
+# List item markers: bullets, numbers, letters, parenthetical numbers
+LIST_ITEM_MARKERS = r'[-*•]\s+|\d+\.\s+|[a-zA-Z]\.\s+|\(\d+\)\s+'
+LIST_ITEM_PATTERN = re.compile(rf'^(?:{LIST_ITEM_MARKERS})')
+
+# First characters a heading can start with; any other line skips the heading regex
+HEADING_START_CHARS = frozenset(string.ascii_uppercase + string.digits + '#')
+
+# Classifies a line in one match; heading shapes win over list markers, as in the
+# heading-then-list checks, and lastgroup names the kind
+LINE_KIND_PATTERN = re.compile(rf'^(?:(?P<heading>{HEADING_SHAPES})|(?P<list>{LIST_ITEM_MARKERS}))')
+
+# Section numbering such as 1, 1.2 or 1.2.3; each matched sub-number adds a heading level
+HEADING_NUMBER_PATTERN = re.compile(r'^(\d+)(\.\d+)?(\.\d+)?')
+
+# Capitalized words and phrases used as fallback concept candidates
+CAPITALIZED_PHRASE_PATTERN = re.compile(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b')
+
+# Defaults for missing educational metadata fields; tuple values are copied into fresh lists
+METADATA_DEFAULTS = (
+    ("learning_objectives", ()),
+    ("key_topics", ()),
+    ("difficulty_level", "intermediate"),
+    ("estimated_reading_time", 5),
+    ("target_audience", "General learners"),
+    ("prerequisites", ()),
+    ("bloom_taxonomy_levels", ("remember", "understand")),
+    ("content_type", "other"),
+    ("summary", "Educational content analysis"),
+    ("main_themes", ()),
+)
+
+# Combined concept/metadata replies kept per agent; only needs to span one document's two steps
+COMBINED_RESPONSE_CACHE_SIZE = 8
+
+# Optional on-disk cache of model replies, enabled with MYTUTOR_LLM_CACHE=1 so re-processing
+# the same document skips Bedrock. Bump the version whenever the analysis prompt changes.
+LLM_CACHE_ENABLED = os.getenv("MYTUTOR_LLM_CACHE", "0") == "1"
+LLM_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / "backend" / "data" / "text_llm_cache"
+ANALYSIS_PROMPT_VERSION = "1"
+
+# Fallback concepts remembered per text digest, so retries of the same document skip the
+# full-text scan; shorter texts are cheaper to rescan than to hash
+FALLBACK_CACHE_SIZE = 256
+FALLBACK_CACHE_MIN_CHARS = 1024
+
+# Preview size for result content; shorter documents are returned whole as the preview
+PREVIEW_MAX_LENGTH = 8000
+
+# Characters split at a time when only a word count is needed, bounding the temporary word list
+WORD_COUNT_CHUNK_SIZE = 1 << 16
+
+# Texts with fewer blank-line breaks than this have no paragraphs worth prioritising and
+# are previewed by plain truncation
+MIN_PREVIEW_PARAGRAPH_BREAKS = 4
+
+# Removes punctuation when normalising paragraphs to spot repeated headers, footers and boilerplate
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# Words marking a paragraph as important for the smart preview, matched anywhere in one pass
+PREVIEW_KEYWORDS = (
+    'introduction', 'conclusion', 'summary', 'important', 'key', 'definition',
+    'overview', 'objective', 'goal', 'purpose', 'main', 'primary', 'essential'
+)
+PREVIEW_KEYWORD_PATTERN = re.compile('|'.join(PREVIEW_KEYWORDS), re.IGNORECASE)
+
+# Difficulty levels accepted from model metadata
+VALID_DIFFICULTIES = frozenset(("beginner", "intermediate", "advanced"))
+
 try:
     from ..config.model_manager import model_config_manager
 except ImportError:
@@ -35,6 +110,16 @@ class TextStructure:
     lists: List[Dict[str, Any]]
     tables: List[Dict[str, Any]]
     formatting: Dict[str, Any]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Shallow dict view; unlike asdict, field values are shared rather than deep-copied."""
+        return {
+            "headings": self.headings,
+            "paragraphs": self.paragraphs,
+            "lists": self.lists,
+            "tables": self.tables,
+            "formatting": self.formatting
+        }
 
 
 @dataclass
@@ -45,6 +130,16 @@ class KeyConcept:
     importance: float  # 0.0 to 1.0
     confidence: float  # 0.0 to 1.0
     context: str
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict view of the concept."""
+        return {
+            "concept": self.concept,
+            "definition": self.definition,
+            "importance": self.importance,
+            "confidence": self.confidence,
+            "context": self.context
+        }
 
 
 @dataclass
@@ -55,6 +150,16 @@ class EnhancedTextAnalysis:
     educational_metadata: Dict[str, Any]
     confidence_scores: Dict[str, float]
     processing_metrics: Dict[str, Any]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Shallow dict view for results; nested dataclasses become dicts, other values are shared."""
+        return {
+            "structure": self.structure.to_dict(),
+            "key_concepts": [concept.to_dict() for concept in self.key_concepts],
+            "educational_metadata": self.educational_metadata,
+            "confidence_scores": self.confidence_scores,
+            "processing_metrics": self.processing_metrics
+        }
 
 
 class TextAgent:
@@ -65,6 +170,11 @@ class TextAgent:
         self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
         self.supported_extensions = ['.txt', '.docx', '.doc', '.pptx', '.ppt', '.rtf', '.odt']
         self.model_manager = model_config_manager
+        # Recent combined concept/metadata replies keyed by (model id, prompt)
+        self._combined_responses: Dict[Tuple[str, str], str] = {}
+        self._fallback_concepts: Dict[bytes, List[KeyConcept]] = {}
+        # Successful path resolutions only, so files uploaded later are still found
+        self._resolved_paths: Dict[str, str] = {}
     
     def can_process(self, file_path: str) -> bool:
         """Check if this agent can process the given file."""
@@ -72,7 +182,9 @@ class TextAgent:
     
     def _resolve_file_path(self, file_path: str) -> str:
         """Resolve file path relative to project structure."""
-        from pathlib import Path
+        cached_path = self._resolved_paths.get(file_path)
+        if cached_path is not None:
+            return cached_path
         
         file_path_obj = Path(file_path)
         logger.debug(f"TEXT Agent - Resolving file path: {file_path_obj}")
@@ -80,18 +192,21 @@ class TextAgent:
         # If the path exists as-is, use it
         if file_path_obj.exists():
             logger.info(f"TEXT Agent - Found file at original path: {file_path_obj}")
+            self._resolved_paths[file_path] = str(file_path_obj)
             return str(file_path_obj)
         
         # Try in backend directory (most common case)
         backend_path = Path("backend") / file_path_obj
         if backend_path.exists():
             logger.info(f"TEXT Agent - Found file at backend path: {backend_path}")
+            self._resolved_paths[file_path] = str(backend_path)
             return str(backend_path)
         
         # Try relative to backend directory (from agent directory)
         backend_relative_path = Path("../backend") / file_path_obj
         if backend_relative_path.exists():
             logger.info(f"TEXT Agent - Found file at backend relative path: {backend_relative_path}")
+            self._resolved_paths[file_path] = str(backend_relative_path)
             return str(backend_relative_path)
         
         # Return original path if nothing works
@@ -108,10 +223,14 @@ class TextAgent:
 
             # Extract structured content based on file type
             structured_content = await self._extract_structured_content(resolved_path)
+            raw_text = structured_content.get("raw_text", "")
+            
+            # Count words once for the result and any fallback metadata
+            word_stats = self._count_words(raw_text)
 
             # Perform enhanced AI analysis
             enhanced_analysis = await self._perform_enhanced_analysis(
-                structured_content, resolved_path
+                structured_content, resolved_path, word_stats
             )
             
             # Prepare enhanced result
@@ -120,16 +239,13 @@ class TextAgent:
                 "file_path": file_path,
                 "status": "completed",
                 "content": {
-                    "text": self._create_smart_preview(structured_content.get("raw_text", ""), 8000),
-                    "full_text": structured_content.get("raw_text", ""),
-                    "word_count": len(structured_content.get("raw_text", "").split()),
-                    "char_count": len(structured_content.get("raw_text", "")),
+                    **self._text_content(raw_text, word_stats[0]),
                     "structure": structured_content.get("structure"),
                     "formatting": structured_content.get("formatting", {})
                 },
-                "enhanced_analysis": asdict(enhanced_analysis) if enhanced_analysis else {},
+                "enhanced_analysis": enhanced_analysis.to_dict() if enhanced_analysis else {},
                 "metadata": {
-                    "file_size": os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+                    "file_size": self._file_size(resolved_path),
                     "file_type": Path(file_path).suffix.lower(),
                     "processed_by": "enhanced_text_agent",
                     "model_used": self._get_current_model_id(),
@@ -173,11 +289,10 @@ class TextAgent:
     async def _extract_txt_structure(self, file_path: str) -> Dict[str, Any]:
         """Extract structure from plain text files."""
         try:
-            # Resolve file path first
-            resolved_path = self._resolve_file_path(file_path)
-            logger.info(f"TEXT Agent processing resolved path: {resolved_path}")
+            # Callers pass the path already resolved by process_file
+            logger.info(f"TEXT Agent processing resolved path: {file_path}")
             
-            with open(resolved_path, 'r', encoding='utf-8') as f:
+            with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
             
             # Analyze text structure
@@ -195,6 +310,11 @@ class TextAgent:
     
     async def _extract_docx_structure(self, file_path: str) -> Dict[str, Any]:
         """Extract structure from DOCX files with formatting preservation."""
+        # python-docx parsing is blocking XML work, so keep it off the event loop
+        return await asyncio.to_thread(self._extract_docx_structure_sync, file_path)
+    
+    def _extract_docx_structure_sync(self, file_path: str) -> Dict[str, Any]:
+        """Blocking DOCX extraction; run it via asyncio.to_thread."""
         try:
             doc = docx.Document(file_path)
             
@@ -202,27 +322,39 @@ class TextAgent:
             paragraphs = []
             lists = []
             tables = []
-            formatting_info = {"styles": [], "fonts": set()}
+            # Styles are counted rather than listed per paragraph; a document only uses a handful
+            formatting_info = {"style_counts": Counter(), "fonts": set()}
+            style_counts = formatting_info["style_counts"]
+            fonts = formatting_info["fonts"]
+            raw_text_parts = []
             
-            # Extract paragraphs with style information
+            # Extract paragraphs with style information; para.text re-reads the XML on every access
             for para in doc.paragraphs:
-                if para.text.strip():
+                para_text = para.text
+                stripped_text = para_text.strip()
+                if stripped_text:
+                    raw_text_parts.append(para_text)
+                    style_name = para.style.name
+                    
                     # Check if it's a heading
-                    if para.style.name.startswith('Heading'):
-                        level = int(para.style.name.split()[-1]) if para.style.name.split()[-1].isdigit() else 1
+                    if style_name.startswith('Heading'):
+                        level_token = style_name.split()[-1]
+                        level = int(level_token) if level_token.isdigit() else 1
                         headings.append({
-                            "text": para.text.strip(),
+                            "text": stripped_text,
                             "level": level,
-                            "style": para.style.name
+                            "style": style_name
                         })
                     else:
-                        paragraphs.append(para.text.strip())
+                        paragraphs.append(stripped_text)
                     
                     # Track formatting
-                    formatting_info["styles"].append(para.style.name)
+                    style_counts[style_name] += 1
                     for run in para.runs:
-                        if run.font.name:
-                            formatting_info["fonts"].add(run.font.name)
+                        # run.font is rebuilt from the run's XML on each access
+                        font_name = run.font.name
+                        if font_name:
+                            fonts.add(font_name)
             
             # Extract tables
             for table in doc.tables:
@@ -236,10 +368,13 @@ class TextAgent:
                     table_data["content"].append(row_data)
                 tables.append(table_data)
             
-            # Convert sets to lists for JSON serialization
+            # Convert sets and counters to plain types for JSON serialization; "styles" keeps
+            # its list form, naming each style once in order of first use
             formatting_info["fonts"] = list(formatting_info["fonts"])
+            formatting_info["style_counts"] = dict(formatting_info["style_counts"])
+            formatting_info["styles"] = list(formatting_info["style_counts"])
             
-            raw_text = '\n'.join([para.text for para in doc.paragraphs if para.text.strip()])
+            raw_text = '\n'.join(raw_text_parts)
             
             structure = TextStructure(
                 headings=headings,
@@ -261,6 +396,11 @@ class TextAgent:
     
     async def _extract_pptx_structure(self, file_path: str) -> Dict[str, Any]:
         """Extract structure from PowerPoint files."""
+        # python-pptx parsing is blocking XML work, so keep it off the event loop
+        return await asyncio.to_thread(self._extract_pptx_structure_sync, file_path)
+    
+    def _extract_pptx_structure_sync(self, file_path: str) -> Dict[str, Any]:
+        """Blocking PowerPoint extraction; run it via asyncio.to_thread."""
         try:
             prs = Presentation(file_path)
             
@@ -276,14 +416,16 @@ class TextAgent:
                 }
                 
                 for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text.strip():
+                    # shape.text walks the shape's XML on every access, so read it once
+                    shape_text = getattr(shape, "text", "").strip()
+                    if shape_text:
                         # Try to identify title vs content
                         if shape.placeholder_format and shape.placeholder_format.type == 1:  # Title placeholder
-                            slide_data["title"] = shape.text.strip()
+                            slide_data["title"] = shape_text
                         else:
-                            slide_data["content"].append(shape.text.strip())
+                            slide_data["content"].append(shape_text)
                         
-                        all_text.append(shape.text.strip())
+                        all_text.append(shape_text)
                 
                 # Extract slide notes if available
                 if slide.notes_slide and slide.notes_slide.notes_text_frame:
@@ -322,27 +464,25 @@ class TextAgent:
     
     def _analyze_text_structure(self, text: str) -> TextStructure:
         """Analyze structure of plain text content."""
-        lines = text.split('\n')
-        
         headings = []
         paragraphs = []
         lists = []
         current_paragraph = []
         
-        for line in lines:
+        for line in self._iter_lines(text):
             line = line.strip()
-            if not line:
-                if current_paragraph:
-                    paragraphs.append(' '.join(current_paragraph))
-                    current_paragraph = []
+            kind = self._classify_line(line) if line else None
+            if kind is None and line:
+                current_paragraph.append(line)
                 continue
             
+            # Blank lines, headings and list items all end the current paragraph
+            if current_paragraph:
+                paragraphs.append(' '.join(current_paragraph))
+                current_paragraph = []
+            
             # Detect headings (lines that are short, capitalized, or have special formatting)
-            if self._is_likely_heading(line):
-                if current_paragraph:
-                    paragraphs.append(' '.join(current_paragraph))
-                    current_paragraph = []
-                
+            if kind == "heading":
                 headings.append({
                     "text": line,
                     "level": self._estimate_heading_level(line),
@@ -350,18 +490,11 @@ class TextAgent:
                 })
             
             # Detect list items
-            elif self._is_list_item(line):
-                if current_paragraph:
-                    paragraphs.append(' '.join(current_paragraph))
-                    current_paragraph = []
-                
+            elif kind == "list":
                 lists.append({
                     "text": line,
                     "type": "bullet" if line.startswith(('•', '-', '*')) else "numbered"
                 })
-            
-            else:
-                current_paragraph.append(line)
         
         # Add final paragraph if exists
         if current_paragraph:
@@ -375,28 +508,30 @@ class TextAgent:
             formatting={"type": "plain_text"}
         )
     
-    def _is_likely_heading(self, line: str) -> bool:
-        """Determine if a line is likely a heading."""
-        # Check various heading indicators
-        if len(line) < 5:  # Very short lines might be headings
-            return False
-        
-        if len(line) > 100:  # Very long lines are unlikely to be headings
-            return False
-        
-        # Check for common heading patterns
-        heading_patterns = [
-            r'^[A-Z][A-Z\s]+$',  # ALL CAPS
-            r'^\d+\.\s+[A-Z]',   # Numbered headings
-            r'^[A-Z][a-z]+(\s[A-Z][a-z]+)*$',  # Title Case
-            r'^#+\s+',           # Markdown-style headings
-        ]
-        
-        for pattern in heading_patterns:
-            if re.match(pattern, line):
-                return True
+    def _iter_lines(self, text: str) -> Iterator[str]:
+        """Yield the newline-separated lines of text one at a time instead of splitting it all up front."""
+        start = 0
+        while True:
+            end = text.find('\n', start)
+            if end == -1:
+                yield text[start:]
+                return
+            yield text[start:end]
+            start = end + 1
+    
+    def _classify_line(self, line: str) -> Optional[str]:
+        """Return "heading", "list" or None for a stripped, non-empty line with a single regex match."""
+        if line[0] not in HEADING_START_CHARS:
+            # Ordinary prose: only a list marker can still apply
+            return "list" if self._is_list_item(line) else None
         
-        return False
+        match = LINE_KIND_PATTERN.match(line)
+        if match is None:
+            return None
+        if match.lastgroup == "heading" and not 5 <= len(line) <= 100:
+            # Heading-shaped but the wrong length; it may still be a list item
+            return "list" if self._is_list_item(line) else None
+        return match.lastgroup
     
     def _estimate_heading_level(self, line: str) -> int:
         """Estimate the heading level based on formatting."""
@@ -406,32 +541,19 @@ class TextAgent:
             return 2
         elif line.startswith('#'):
             return 1
-        elif re.match(r'^\d+\.\d+\.\d+', line):
-            return 3
-        elif re.match(r'^\d+\.\d+', line):
-            return 2
-        elif re.match(r'^\d+\.', line):
-            return 1
-        else:
-            return 1  # Default to level 1
+        
+        number_match = HEADING_NUMBER_PATTERN.match(line)
+        if number_match and number_match.group(2):
+            return 3 if number_match.group(3) else 2
+        return 1  # Single numbers and everything else are level 1
     
     def _is_list_item(self, line: str) -> bool:
         """Determine if a line is a list item."""
-        list_patterns = [
-            r'^[-*•]\s+',        # Bullet points
-            r'^\d+\.\s+',        # Numbered lists
-            r'^[a-zA-Z]\.\s+',   # Lettered lists
-            r'^\(\d+\)\s+',      # Parenthetical numbers
-        ]
-        
-        for pattern in list_patterns:
-            if re.match(pattern, line):
-                return True
-        
-        return False
+        return LIST_ITEM_PATTERN.match(line) is not None
     
     async def _perform_enhanced_analysis(self, structured_content: Dict[str, Any], 
-                                        file_path: str) -> Optional[EnhancedTextAnalysis]:
+                                        file_path: str,
+                                        word_stats: Optional[Tuple[int, int]] = None) -> Optional[EnhancedTextAnalysis]:
         """Perform enhanced AI analysis with key concept extraction and confidence scoring."""
         try:
             # Get the appropriate model for analysis
@@ -442,12 +564,10 @@ class TextAgent:
             raw_text = structured_content.get("raw_text", "")
             structure = structured_content.get("structure")
             
-            # Perform key concept extraction
-            key_concepts = await self._extract_key_concepts(raw_text, model_spec)
-            
-            # Generate educational metadata
+            # Both come from one combined model call; the metadata step reuses the cached reply
+            key_concepts = await self._extract_key_concepts(raw_text, model_spec, structure)
             educational_metadata = await self._generate_educational_metadata(
-                raw_text, structure, model_spec
+                raw_text, structure, model_spec, word_stats
             )
             
             # Calculate confidence scores
@@ -479,16 +599,28 @@ class TextAgent:
         except Exception as e:
             logger.error(f"Error in enhanced analysis: {e}")
             # Try fallback analysis
-            return await self._fallback_analysis(structured_content, file_path, str(e))
+            return await self._fallback_analysis(structured_content, file_path, str(e), word_stats)
     
-    async def _extract_key_concepts(self, text: str, model_spec) -> List[KeyConcept]:
-        """Extract key concepts with confidence scoring using AI."""
-        try:
-            # Limit text for analysis to avoid token limits
-            analysis_text = text[:3000] if len(text) > 3000 else text
-            
-            prompt = f"""
-Analyze the following text and extract key concepts with detailed information:
+    async def _extract_combined(self, text: str, structure, model_spec) -> str:
+        """Request key concepts and educational metadata in one model call; returns the raw JSON reply."""
+        # Prepare structure summary
+        structure_summary = ""
+        if structure:
+            structure_summary = f"""
+Structure Analysis:
+- Headings: {len(structure.headings)} found
+- Paragraphs: {len(structure.paragraphs)}
+- Lists: {len(structure.lists)}
+- Tables: {len(structure.tables)}
+"""
+        
+        # Limit text for analysis to avoid token limits
+        analysis_text = text[:3000] if len(text) > 3000 else text
+        
+        prompt = f"""
+Analyze the following educational content, extract its key concepts and generate comprehensive metadata:
+
+{structure_summary}
 
 Text: {analysis_text}
 
@@ -499,25 +631,88 @@ For each key concept, provide:
 4. Confidence score (0.0 to 1.0) - how confident you are in this extraction
 5. Context - where/how this concept appears in the text
 
-Return ONLY a valid JSON array with this structure:
-[
-  {{
-    "concept": "concept name",
-    "definition": "clear definition",
-    "importance": 0.8,
-    "confidence": 0.9,
-    "context": "brief context"
+Return ONLY a valid JSON object with this structure:
+{{
+  "concepts": [
+    {{
+      "concept": "concept name",
+      "definition": "clear definition",
+      "importance": 0.8,
+      "confidence": 0.9,
+      "context": "brief context"
+    }}
+  ],
+  "metadata": {{
+    "learning_objectives": ["objective 1", "objective 2", ...],
+    "key_topics": ["topic 1", "topic 2", ...],
+    "difficulty_level": "beginner|intermediate|advanced",
+    "estimated_reading_time": minutes_as_integer,
+    "target_audience": "description of intended audience",
+    "prerequisites": ["prerequisite 1", "prerequisite 2", ...],
+    "bloom_taxonomy_levels": ["remember", "understand", "apply", "analyze", "evaluate", "create"],
+    "content_type": "lecture|tutorial|reference|exercise|other",
+    "summary": "2-3 sentence summary",
+    "main_themes": ["theme 1", "theme 2", ...]
   }}
-]
+}}
 
 Extract 5-10 most important concepts. Focus on educational or technical terms that are central to understanding the content.
+For the metadata, focus on educational value and learning outcomes. Be specific and actionable.
 """
-            
-            response = await self._invoke_model(model_spec, prompt, max_tokens=2000)
+        
+        # Both wrappers ask for the same prompt, so the second one reuses the first reply
+        cache_key = (model_spec.model_id, prompt)
+        cached_response = self._combined_responses.get(cache_key)
+        if cached_response is not None:
+            return cached_response
+        
+        cache_path = self._get_llm_cache_path(model_spec.model_id, prompt) if LLM_CACHE_ENABLED else None
+        response = self._load_cached_response(cache_path) if cache_path is not None else None
+        if response is None:
+            response = await self._invoke_model(model_spec, prompt, max_tokens=3500)
+            if cache_path is not None:
+                self._store_cached_response(cache_path, response)
+        
+        self._remember(self._combined_responses, cache_key, response, COMBINED_RESPONSE_CACHE_SIZE)
+        return response
+    
+    def _get_llm_cache_path(self, model_id: str, prompt: str) -> Path:
+        """Return the disk cache file for a model reply to this prompt."""
+        digest = hashlib.sha256(f"{model_id}\0{ANALYSIS_PROMPT_VERSION}\0{prompt}".encode('utf-8', 'surrogatepass'))
+        return LLM_CACHE_DIR / f"{digest.hexdigest()}.json"
+    
+    def _load_cached_response(self, cache_path: Path) -> Optional[str]:
+        """Load a cached model reply, or None if there is no usable entry."""
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("response")
+        except FileNotFoundError:
+            return None
+        except (OSError, AttributeError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable LLM cache entry {cache_path}: {e}")
+            return None
+    
+    def _store_cached_response(self, cache_path: Path, response: str) -> None:
+        """Persist a model reply atomically; caching failures never fail processing."""
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"response": response}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write LLM cache entry {cache_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+    
+    async def _extract_key_concepts(self, text: str, model_spec, structure=None) -> List[KeyConcept]:
+        """Extract key concepts with confidence scoring using AI."""
+        try:
+            response = await self._extract_combined(text, structure, model_spec)
             
             # Parse the JSON response
             try:
-                concepts_data = json.loads(response)
+                analysis = json.loads(response)
+                concepts_data = analysis.get("concepts", []) if isinstance(analysis, dict) else []
                 key_concepts = []
                 
                 for concept_data in concepts_data:
@@ -542,60 +737,27 @@ Extract 5-10 most important concepts. Focus on educational or technical terms th
             logger.error(f"Error extracting key concepts: {e}")
             return self._fallback_concept_extraction(text)
     
-    async def _generate_educational_metadata(self, text: str, structure, model_spec) -> Dict[str, Any]:
+    async def _generate_educational_metadata(self, text: str, structure, model_spec,
+                                             word_stats: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
         """Generate educational metadata using AI analysis."""
         try:
-            # Prepare structure summary
-            structure_summary = ""
-            if structure:
-                structure_summary = f"""
-Structure Analysis:
-- Headings: {len(structure.headings)} found
-- Paragraphs: {len(structure.paragraphs)}
-- Lists: {len(structure.lists)}
-- Tables: {len(structure.tables)}
-"""
-            
-            analysis_text = text[:2500] if len(text) > 2500 else text
-            
-            prompt = f"""
-Analyze this educational content and generate comprehensive metadata:
-
-{structure_summary}
-
-Content: {analysis_text}
-
-Generate educational metadata in JSON format:
-{{
-  "learning_objectives": ["objective 1", "objective 2", ...],
-  "key_topics": ["topic 1", "topic 2", ...],
-  "difficulty_level": "beginner|intermediate|advanced",
-  "estimated_reading_time": minutes_as_integer,
-  "target_audience": "description of intended audience",
-  "prerequisites": ["prerequisite 1", "prerequisite 2", ...],
-  "bloom_taxonomy_levels": ["remember", "understand", "apply", "analyze", "evaluate", "create"],
-  "content_type": "lecture|tutorial|reference|exercise|other",
-  "summary": "2-3 sentence summary",
-  "main_themes": ["theme 1", "theme 2", ...]
-}}
-
-Focus on educational value and learning outcomes. Be specific and actionable.
-"""
-            
-            response = await self._invoke_model(model_spec, prompt, max_tokens=1500)
+            response = await self._extract_combined(text, structure, model_spec)
             
             try:
-                metadata = json.loads(response)
+                analysis = json.loads(response)
+                metadata = analysis.get("metadata") if isinstance(analysis, dict) else None
+                if not isinstance(metadata, dict):
+                    raise ValueError("Model response has no metadata object")
                 # Validate and clean the metadata
                 return self._validate_educational_metadata(metadata)
                 
             except json.JSONDecodeError:
                 logger.error("Failed to parse educational metadata JSON")
-                return self._generate_fallback_metadata(text)
+                return self._generate_fallback_metadata(text, word_stats)
             
         except Exception as e:
             logger.error(f"Error generating educational metadata: {e}")
-            return self._generate_fallback_metadata(text)
+            return self._generate_fallback_metadata(text, word_stats)
     
     def _calculate_confidence_scores(self, text: str, key_concepts: List[KeyConcept], 
                                    educational_metadata: Dict[str, Any]) -> Dict[str, float]:
@@ -634,18 +796,8 @@ Focus on educational value and learning outcomes. Be specific and actionable.
     async def _invoke_model(self, model_spec, prompt: str, max_tokens: int = 1000) -> str:
         """Invoke the specified model with fallback handling."""
         try:
-            response = self.bedrock_client.invoke_model(
-                modelId=model_spec.model_id,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": max_tokens,
-                    "temperature": model_spec.temperature,
-                    "messages": [{"role": "user", "content": prompt}]
-                })
-            )
-            
-            result = json.loads(response['body'].read())
-            return result['content'][0]['text']
+            # boto3 blocks, so run the call in a worker thread to let other requests overlap
+            return await asyncio.to_thread(self._invoke_model_sync, model_spec, prompt, max_tokens)
             
         except Exception as e:
             logger.error(f"Model invocation failed: {e}")
@@ -657,27 +809,51 @@ Focus on educational value and learning outcomes. Be specific and actionable.
             else:
                 raise e
     
+    def _invoke_model_sync(self, model_spec, prompt: str, max_tokens: int) -> str:
+        """Blocking Bedrock call returning the response text."""
+        response = self.bedrock_client.invoke_model(
+            modelId=model_spec.model_id,
+            body=json.dumps({
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": max_tokens,
+                "temperature": model_spec.temperature,
+                "messages": [{"role": "user", "content": prompt}]
+            })
+        )
+        
+        result = json.loads(response['body'].read())
+        return result['content'][0]['text']
+    
     def _get_current_model_id(self) -> str:
         """Get the current model ID being used."""
-        model_spec = self.model_manager.get_model_for_agent("text")
+        model_spec = self.model_manager.get_model_for_agent("text", "text")
         return model_spec.model_id if model_spec else "unknown"
     
+    def _remember(self, cache: Dict, key, value, max_entries: int) -> None:
+        """Store value in a small insertion-ordered cache, evicting the oldest entry when full."""
+        if len(cache) >= max_entries:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = value
+    
+    def _fallback_cache_key(self, text: str) -> Optional[bytes]:
+        """Digest of text for the fallback caches, or None if it is too short to be worth caching."""
+        if len(text) < FALLBACK_CACHE_MIN_CHARS:
+            return None
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    
     def _fallback_concept_extraction(self, text: str) -> List[KeyConcept]:
         """Fallback method for concept extraction using simple heuristics."""
-        concepts = []
+        cache_key = self._fallback_cache_key(text)
+        if cache_key is not None and cache_key in self._fallback_concepts:
+            return list(self._fallback_concepts[cache_key])
         
-        # Simple keyword extraction based on capitalization and frequency
-        words = re.findall(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b', text)
-        word_freq = {}
+        concepts = []
         
-        for word in words:
-            if len(word) > 3:  # Ignore short words
-                word_freq[word] = word_freq.get(word, 0) + 1
+        # Simple keyword extraction based on capitalization and frequency, ignoring short words
+        word_freq = Counter(word for word in CAPITALIZED_PHRASE_PATTERN.findall(text) if len(word) > 3)
         
         # Get top concepts by frequency
-        sorted_concepts = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        for concept, freq in sorted_concepts:
+        for concept, freq in word_freq.most_common(5):
             concepts.append(KeyConcept(
                 concept=concept,
                 definition=f"Key term appearing {freq} times in the text",
@@ -686,15 +862,37 @@ Focus on educational value and learning outcomes. Be specific and actionable.
                 context="Extracted using frequency analysis"
             ))
         
+        if cache_key is not None:
+            self._remember(self._fallback_concepts, cache_key, concepts, FALLBACK_CACHE_SIZE)
+            return list(concepts)
         return concepts
     
-    def _generate_fallback_metadata(self, text: str) -> Dict[str, Any]:
+    def _count_words(self, text: str) -> Tuple[int, int]:
+        """Return the word count and total word characters from a single split."""
+        words = text.split()
+        return len(words), sum(map(len, words))
+    
+    def _word_count(self, text: str) -> int:
+        """Count whitespace-separated words like len(text.split()) without a list of every word."""
+        word_count = 0
+        previous_ends_in_word = False
+        for start in range(0, len(text), WORD_COUNT_CHUNK_SIZE):
+            chunk = text[start:start + WORD_COUNT_CHUNK_SIZE]
+            word_count += len(chunk.split())
+            # A word straddling the chunk boundary was counted in both chunks
+            if previous_ends_in_word and not chunk[0].isspace():
+                word_count -= 1
+            previous_ends_in_word = not chunk[-1].isspace()
+        return word_count
+    
+    def _generate_fallback_metadata(self, text: str,
+                                    word_stats: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
         """Generate basic metadata using simple heuristics."""
-        word_count = len(text.split())
+        word_count, word_chars = word_stats if word_stats is not None else self._count_words(text)
         estimated_reading_time = max(1, word_count // 200)  # Assume 200 words per minute
         
         # Simple difficulty assessment based on text characteristics
-        avg_word_length = sum(len(word) for word in text.split()) / max(len(text.split()), 1)
+        avg_word_length = word_chars / max(word_count, 1)
         if avg_word_length > 6:
             difficulty = "advanced"
         elif avg_word_length > 4:
@@ -702,7 +900,7 @@ Focus on educational value and learning outcomes. Be specific and actionable.
         else:
             difficulty = "beginner"
         
-        return {
+        metadata = {
             "learning_objectives": ["Understand the main concepts presented in the text"],
             "key_topics": ["General content analysis"],
             "difficulty_level": difficulty,
@@ -714,30 +912,19 @@ Focus on educational value and learning outcomes. Be specific and actionable.
             "summary": f"Text document with approximately {word_count} words covering various topics.",
             "main_themes": ["Content analysis"]
         }
+        
+        return metadata
     
     def _validate_educational_metadata(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Validate and clean educational metadata."""
         # Ensure required fields exist with defaults
-        defaults = {
-            "learning_objectives": [],
-            "key_topics": [],
-            "difficulty_level": "intermediate",
-            "estimated_reading_time": 5,
-            "target_audience": "General learners",
-            "prerequisites": [],
-            "bloom_taxonomy_levels": ["remember", "understand"],
-            "content_type": "other",
-            "summary": "Educational content analysis",
-            "main_themes": []
-        }
-        
-        for key, default_value in defaults.items():
-            if key not in metadata or not metadata[key]:
-                metadata[key] = default_value
+        for key, default_value in METADATA_DEFAULTS:
+            if not metadata.get(key):
+                metadata[key] = list(default_value) if isinstance(default_value, tuple) else default_value
         
         # Validate difficulty level
-        valid_difficulties = ["beginner", "intermediate", "advanced"]
-        if metadata["difficulty_level"] not in valid_difficulties:
+        difficulty = metadata["difficulty_level"]
+        if not isinstance(difficulty, str) or difficulty not in VALID_DIFFICULTIES:
             metadata["difficulty_level"] = "intermediate"
         
         # Ensure reading time is reasonable
@@ -746,29 +933,29 @@ Focus on educational value and learning outcomes. Be specific and actionable.
         
         return metadata
     
+    def _read_fallback_text(self, file_path: str) -> Tuple[str, int]:
+        """Read a file as lenient UTF-8 and count its words; run it via asyncio.to_thread."""
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+        return content, self._word_count(content)
+    
     async def _fallback_processing(self, file_path: str, error_msg: str) -> Dict[str, Any]:
         """Fallback processing when enhanced analysis fails."""
         try:
             # Resolve file path first
             resolved_path = self._resolve_file_path(file_path)
             
-            # Try basic text extraction
-            with open(resolved_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            # Try basic text extraction; reading and counting a large file would stall the event loop
+            content, word_count = await asyncio.to_thread(self._read_fallback_text, resolved_path)
             
             return {
                 "agent_type": "text",
                 "file_path": file_path,
                 "status": "completed_with_fallback",
-                "content": {
-                    "text": self._create_smart_preview(content, 8000),
-                    "full_text": content,
-                    "word_count": len(content.split()),
-                    "char_count": len(content)
-                },
+                "content": self._text_content(content, word_count),
                 "enhanced_analysis": {},
                 "metadata": {
-                    "file_size": os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+                    "file_size": self._file_size(resolved_path),
                     "file_type": Path(file_path).suffix.lower(),
                     "processed_by": "text_agent_fallback",
                     "error": error_msg,
@@ -785,14 +972,15 @@ Focus on educational value and learning outcomes. Be specific and actionable.
             }
     
     async def _fallback_analysis(self, structured_content: Dict[str, Any], 
-                                file_path: str, error_msg: str) -> Optional[EnhancedTextAnalysis]:
+                                file_path: str, error_msg: str,
+                                word_stats: Optional[Tuple[int, int]] = None) -> Optional[EnhancedTextAnalysis]:
         """Fallback analysis when enhanced analysis fails."""
         try:
             raw_text = structured_content.get("raw_text", "")
             
             # Use simple fallback methods
             key_concepts = self._fallback_concept_extraction(raw_text)
-            educational_metadata = self._generate_fallback_metadata(raw_text)
+            educational_metadata = self._generate_fallback_metadata(raw_text, word_stats)
             confidence_scores = {"overall": 0.5, "fallback_used": True}
             
             structure = structured_content.get("structure") or TextStructure([], [], [], [], {})
@@ -816,44 +1004,106 @@ Focus on educational value and learning outcomes. Be specific and actionable.
             logger.error(f"Fallback analysis also failed: {e}")
             return None
 
+    def _file_size(self, file_path: str) -> int:
+        """Size of the file in bytes, or 0 if it cannot be stat-ed."""
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+    
+    def _text_content(self, text: str, word_count: int) -> Dict[str, Any]:
+        """Build the text fields of a result; full_text is only added when it differs from the preview."""
+        content = {"text": self._create_smart_preview(text, PREVIEW_MAX_LENGTH)}
+        if len(text) > PREVIEW_MAX_LENGTH:
+            # Readers use content.get("full_text", content.get("text")), so short texts are stored once
+            content["full_text"] = text
+        content["word_count"] = word_count
+        content["char_count"] = len(text)
+        return content
+    
+    def _iter_paragraphs(self, content: str) -> Iterator[str]:
+        """Yield the blank-line separated paragraphs of content without splitting it all up front."""
+        start = 0
+        while True:
+            end = content.find('\n\n', start)
+            if end == -1:
+                yield content[start:]
+                return
+            yield content[start:end]
+            start = end + 2
+    
+    def _paragraph_fingerprint(self, para: str) -> bytes:
+        """64-bit digest of a paragraph ignoring case, punctuation and whitespace differences."""
+        normalized = ' '.join(para.lower().translate(PUNCTUATION_TABLE).split())
+        return hashlib.blake2b(normalized.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    
+    def _has_paragraph_breaks(self, content: str, minimum: int) -> bool:
+        """Whether content has at least minimum blank-line breaks, stopping at the minimum-th one."""
+        position = -2
+        for _ in range(minimum):
+            position = content.find('\n\n', position + 2)
+            if position == -1:
+                return False
+        return True
+    
     def _create_smart_preview(self, content: str, max_length: int = 8000) -> str:
         """Create a smart preview that preserves important content instead of simple truncation."""
         if len(content) <= max_length:
             return content
         
-        # Split content into paragraphs
-        paragraphs = content.split('\n\n')
+        if not self._has_paragraph_breaks(content, MIN_PREVIEW_PARAGRAPH_BREAKS):
+            return content[:max_length] + f"\n\n[Content continues... {len(content) - max_length} more characters]"
         
-        # Prioritize paragraphs that contain important information
+        # Prioritize paragraphs that contain important information. Important paragraphs are
+        # taken in order until one does not fit; regular ones are only kept while they could
+        # still fit on their own, so the scan stops once neither list can grow
         important_paragraphs = []
         regular_paragraphs = []
+        current_length = 0
+        regular_length = 0
+        important_full = False
+        regular_full = False
+        seen_paragraphs = set()
         
-        for para in paragraphs:
+        for para in self._iter_paragraphs(content):
             para = para.strip()
             if not para:
                 continue
             
-            # Check if paragraph contains important keywords or patterns
-            if (any(keyword in para.lower() for keyword in 
-                   ['introduction', 'conclusion', 'summary', 'important', 'key', 'definition', 
-                    'overview', 'objective', 'goal', 'purpose', 'main', 'primary', 'essential']) or
-                para.startswith('#') or  # Headings
-                ':' in para[:100] or  # Likely definitions or key points
-                len(para.split()) < 50):  # Short paragraphs are often important
-                important_paragraphs.append(para)
-            else:
-                regular_paragraphs.append(para)
+            # Check if paragraph contains important patterns or keywords, cheapest tests first.
+            # Repeated boilerplate would spend the budget twice, so a paragraph equivalent to one
+            # already kept is skipped; only paragraphs about to change a list are fingerprinted
+            if (para.startswith('#') or  # Headings
+                para.find(':', 0, 100) != -1 or  # Likely definitions or key points
+                PREVIEW_KEYWORD_PATTERN.search(para) or
+                len(para.split(None, 49)) < 50):  # Short paragraphs are often important; stop at word 50
+                if important_full:
+                    continue
+                fingerprint = self._paragraph_fingerprint(para)
+                if fingerprint in seen_paragraphs:
+                    continue
+                if current_length + len(para) > max_length:
+                    important_full = True
+                else:
+                    seen_paragraphs.add(fingerprint)
+                    important_paragraphs.append(para)
+                    current_length += len(para) + 2  # +2 for \n\n
+            elif not regular_full:
+                fingerprint = self._paragraph_fingerprint(para)
+                if fingerprint in seen_paragraphs:
+                    continue
+                if regular_length + len(para) > max_length:
+                    regular_full = True
+                else:
+                    seen_paragraphs.add(fingerprint)
+                    regular_paragraphs.append(para)
+                    regular_length += len(para) + 2
+            
+            if important_full and regular_full:
+                break
         
         # Build preview starting with important paragraphs
-        preview_parts = []
-        current_length = 0
-        
-        # Add important paragraphs first
-        for para in important_paragraphs:
-            if current_length + len(para) > max_length:
-                break
-            preview_parts.append(para)
-            current_length += len(para) + 2  # +2 for \n\n
+        preview_parts = important_paragraphs
         
         # Add regular paragraphs until we reach the limit
         for para in regular_paragraphs:
@@ -862,12 +1112,15 @@ Focus on educational value and learning outcomes. Be specific and actionable.
             preview_parts.append(para)
             current_length += len(para) + 2
         
-        # If we still have space, add a truncation indicator
-        result = '\n\n'.join(preview_parts)
-        if len(content) > len(result):
-            result += f"\n\n[Content continues... {len(content) - len(result)} more characters]"
+        # Add the truncation indicator as a final part so the preview is joined in one allocation;
+        # current_length already counts a separator after the last part
+        remaining = len(content) - (current_length - 2 if preview_parts else 0)
+        if remaining > 0:
+            if not preview_parts:
+                preview_parts.append('')  # Indicator still follows a paragraph break
+            preview_parts.append(f"[Content continues... {remaining} more characters]")
         
-        return result
+        return '\n\n'.join(preview_parts)
 
 
 # Global instance
@@ -0,0 +1,12 @@
+"""
+Bedrock Call Limits
+Process-wide cap on concurrent Bedrock calls, shared by every agent
+"""
+import os
+import threading
+
+# Concurrent Bedrock calls allowed across all agents in the process. A thread
+# semaphore (taken on the worker thread) rather than an asyncio one, because course
+# processing runs agents on several event loops.
+BEDROCK_CONCURRENCY = int(os.getenv("BEDROCK_CONCURRENCY", "4"))
+BEDROCK_CALL_SLOTS = threading.BoundedSemaphore(BEDROCK_CONCURRENCY)
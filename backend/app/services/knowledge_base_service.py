@@ -11,6 +11,7 @@ from typing import Dict, Any, List, Optional
 from enum import Enum
 from pydantic import BaseModel
 import asyncio
+import shutil
 from pathlib import Path
 
 from app.services.agent_client import agent_client
@@ -1006,6 +1007,9 @@ class KnowledgeBaseService:
             # Clean up uploaded files
             await self._cleanup_uploaded_files(kb_id, user_id)
 
+            # Clean up images the PDF agent extracted for this knowledge base
+            self._cleanup_extracted_pdf_images(kb_id)
+
             # Clean up any associated training sessions FIRST
             sessions_to_remove = [
                 session_id for session_id, session in self.training_sessions.items()
@@ -1108,6 +1112,38 @@ class KnowledgeBaseService:
         except Exception as e:
             logger.info(f"⚠️ Warning: Could not clean up files for KB {kb_id}: {e}")
 
+    def _cleanup_extracted_pdf_images(self, kb_id: str):
+        """Delete the PDF image directories referenced by a knowledge base's PDF results."""
+        try:
+            results_file = Path("data/kb_results") / kb_id / "pdf_results.json"
+            if not results_file.exists():
+                return
+
+            with open(results_file, 'r', encoding='utf-8') as f:
+                results = json.load(f).get("results", [])
+            if isinstance(results, dict):
+                results = [results]
+
+            # Only ever delete inside the PDF agent's image directory
+            images_root = Path("data/pdf_images").resolve()
+            image_dirs = set()
+            for result in results:
+                content = result.get("content", {}) if isinstance(result, dict) else {}
+                for image in content.get("images", []):
+                    if isinstance(image, dict) and image.get("path"):
+                        image_dir = Path(image["path"]).resolve().parent
+                        if image_dir.parent == images_root:
+                            image_dirs.add(image_dir)
+
+            for image_dir in image_dirs:
+                shutil.rmtree(image_dir, ignore_errors=True)
+
+            if image_dirs:
+                logger.info(f"✅ Cleaned up {len(image_dirs)} extracted PDF image directories for KB {kb_id}")
+
+        except Exception as e:
+            logger.info(f"⚠️ Warning: Could not clean up extracted PDF images for KB {kb_id}: {e}")
+
     def _init_memory(self):
         """Initialize AgentCore Memory for knowledge base persistence."""
         # Memory operations are handled by the agent, not the backend